@@ -0,0 +1,282 @@
+# coding=utf-8
+
+"""
+This module contains a reproducible benchmark suite for the prime sieves and the factoring
+routines. Results are written as JSON (along with a description of the machine they were
+measured on) and can be compared against a stored baseline to flag regressions.
+
+-> SIEVES
+prime_sieve, segmented_sieve and sieve_of_atkin are timed at powers of 10 (10^6 - 10^9 by
+default). Each measurement is the best of a few runs.
+
+-> FACTORING ROUTINES
+factorize_small, factorize_rho, factorize_pm1, factorize_ecm (on Montgomery curves, on
+twisted Edwards curves and on batches of affine curves), factorize_siqs and
+factor.factorize are timed on semiprimes with two factors of (roughly) equal size, a few
+per digit band. The semiprimes and the random choices made by the routines themselves
+(offsets, curves) are seeded, so runs with the same seed do the exact same work. The
+factorization cache (see factorCache.py) is turned off while the routines are timed.
+
+USAGE:
+    python benchmark.py -o results.json
+    python benchmark.py --quick --baseline results.json
+
+The second command exits with a non-zero status if any benchmark got slower than its
+baseline by more than the tolerance.
+"""
+
+import sys
+import time
+import json
+import random
+import argparse
+import platform
+import constants
+import utils, primeSieve
+import pollardRho, pollardPm1, ecm, smallFactor, siqs, factor
+
+SIEVES = [
+	("prime_sieve", lambda n: primeSieve.prime_sieve(n)),
+	("segmented_sieve", lambda n: primeSieve.segmented_sieve(2, n)),
+	("sieve_of_atkin", lambda n: primeSieve.sieve_of_atkin(n))
+]
+
+ROUTINES = [
+	("small", smallFactor.factorize_small),
+	("rho", pollardRho.factorize_rho),
+	("pm1", pollardPm1.factorize_pm1),
+	("ecm", ecm.factorize_ecm),
+	("ecm_edwards", lambda n: ecm.factorize_ecm(n, model = ecm.EDWARDS)),
+	("ecm_affine", lambda n: ecm.factorize_ecm(n, model = ecm.AFFINE)),
+	("siqs", siqs.factorize_siqs),
+	("factorize", factor.factorize)
+]
+
+# Sieve limits (as powers of 10) and digit bands (per routine) for a full and a quick run
+SIEVE_EXPONENTS = [6, 7, 8, 9]
+QUICK_SIEVE_EXPONENTS = [6, 7]
+DIGIT_BANDS = {
+	"small": [12, 16, 18],
+	"rho": [12, 16, 20],
+	"pm1": [20, 30, 40],
+	"ecm": [20, 30, 40],
+	"ecm_edwards": [20, 30, 40],
+	"ecm_affine": [20, 30, 40],
+	"siqs": [30, 40, 45],
+	"factorize": [20, 30, 40, 50]
+}
+QUICK_DIGIT_BANDS = {
+	"small": [12, 16],
+	"rho": [12, 16],
+	"pm1": [20],
+	"ecm": [20, 25],
+	"ecm_edwards": [20, 25],
+	"ecm_affine": [20, 25],
+	"siqs": [30],
+	"factorize": [20, 25]
+}
+
+
+def random_prime(digits, rng):
+	"""
+	Returns a random prime with a specified number of digits.
+	"""
+	lo, hi = 10**(digits - 1), 10**digits - 1
+	while True:
+		p = rng.randint(lo, hi) | 1
+		if utils.is_prime(p):
+			return p
+
+
+def semiprimes(digits, count, seed):
+	"""
+	Returns a list of semiprimes with a specified number of digits whose two prime factors
+	have (roughly) the same number of digits. The same seed always gives the same numbers.
+
+	Examples:
+		>>> semiprimes(10, 2, 1)
+		>>> [3249073111, 1299847853]
+	"""
+	rng = random.Random("%d:%d" % (seed, digits))
+	numbers = []
+	while len(numbers) < count:
+		n = random_prime(digits // 2, rng) * random_prime(digits - digits // 2, rng)
+		if len(str(n)) == digits:
+			numbers.append(n)
+	return numbers
+
+
+def best_time(f, repeats):
+	"""
+	Returns the smallest running time of a function over a specified number of runs along
+	with its (last) return value.
+	"""
+	best, value = None, None
+	for _ in xrange(repeats):
+		t = time.time()
+		value = f()
+		t = time.time() - t
+		if best is None or t < best:
+			best = t
+	return best, value
+
+
+def bench_sieves(exponents, repeats):
+	"""
+	Times every sieve up to each of the specified powers of 10.
+	"""
+	results = {}
+	for name, sieve in SIEVES:
+		for e in exponents:
+			n = 10**e
+			t, primes = best_time(lambda: sieve(n), repeats)
+			results["sieve/%s/10^%d" % (name, e)] = {"time": t, "count": len(primes)}
+			del primes
+	return results
+
+
+def bench_routines(bands, count, seed):
+	"""
+	Times every factoring routine on 'count' semiprimes from each of its digit bands. The
+	time reported for a band is the total over its semiprimes.
+	"""
+	results = {}
+	for name, routine in ROUTINES:
+		for digits in bands.get(name, []):
+			total, found = 0.0, 0
+			for i, n in enumerate(semiprimes(digits, count, seed)):
+				random.seed(seed + i)
+				t = time.time()
+				f = routine(n)
+				total += time.time() - t
+				if f != -1:
+					found += 1
+			results["%s/%d" % (name, digits)] = {"time": total, "count": count, "found": found}
+	return results
+
+
+def environment():
+	"""
+	Returns a description of the machine and the configuration the benchmarks ran with.
+	"""
+	return {
+		"python": platform.python_version(),
+		"implementation": platform.python_implementation(),
+		"machine": platform.machine(),
+		"processor": platform.processor(),
+		"system": platform.platform(),
+		"numpy": primeSieve.use_numpy(),
+		"prime_table": constants.USE_PRIME_TABLE,
+		"factor_cache": constants.USE_FACTOR_CACHE
+	}
+
+
+def run(quick = False, seed = constants.BENCH_SEED, repeats = constants.BENCH_REPEATS, \
+		count = constants.BENCH_COUNT, sieves = True, routines = True):
+	"""
+	Runs the benchmark suite.
+
+	Arguments:
+		quick (:bool) - flag to indicate whether to use the smaller sieve limits and digit
+		                bands
+		seed (:int) - the seed for the semiprimes and the factoring routines
+		repeats (:int) - the number of runs each sieve is timed over
+		count (:int) - the number of semiprimes per digit band
+		sieves (:bool) - flag to indicate whether to time the sieves
+		routines (:bool) - flag to indicate whether to time the factoring routines
+
+	Returns:
+		a dictionary with the environment, the parameters and the results, which maps the
+		name of each benchmark to its time (in seconds) and some details
+	"""
+	# Do the one-time precomputation (e.g. building the prime table) up front
+	factor._warm_up()
+	# Factorizations cached by earlier runs would be looked up instead of timed
+	use_cache, constants.USE_FACTOR_CACHE = constants.USE_FACTOR_CACHE, False
+	try:
+		results = {}
+		if sieves:
+			results.update(bench_sieves(QUICK_SIEVE_EXPONENTS if quick else SIEVE_EXPONENTS, \
+										repeats))
+		if routines:
+			results.update(bench_routines(QUICK_DIGIT_BANDS if quick else DIGIT_BANDS, count, seed))
+		return {
+			"environment": environment(),
+			"parameters": {"quick": quick, "seed": seed, "repeats": repeats, "count": count},
+			"results": results
+		}
+	finally:
+		constants.USE_FACTOR_CACHE = use_cache
+
+
+def compare(current, baseline, tolerance = constants.BENCH_TOLERANCE):
+	"""
+	Compares benchmark results against a baseline. Benchmarks missing from either one are
+	skipped.
+
+	Arguments:
+		current (:dict) - the results of run()
+		baseline (:dict) - the results of an earlier run()
+		tolerance (:float) - the relative slowdown allowed before a benchmark is flagged
+
+	Returns:
+		a sorted list of (name, baseline time, current time, ratio, regressed) tuples
+	"""
+	rows = []
+	old, new = baseline["results"], current["results"]
+	for name in sorted(set(old) & set(new)):
+		t0, t1 = old[name]["time"], new[name]["time"]
+		ratio = t1 / t0 if t0 > 0 else float("inf") if t1 > 0 else 1.0
+		rows.append((name, t0, t1, ratio, ratio > 1 + tolerance))
+	return rows
+
+
+def print_results(report):
+	"""
+	Prints benchmark results as a table.
+	"""
+	results = report["results"]
+	for name in sorted(results):
+		r = results[name]
+		extra = ""
+		if "found" in r:
+			extra = "(%d/%d factored)" % (r["found"], r["count"])
+		print "%-32s %10.4fs  %s" % (name, r["time"], extra)
+
+
+def print_comparison(rows):
+	"""
+	Prints a comparison against a baseline as a table.
+	"""
+	for name, t0, t1, ratio, regressed in rows:
+		print "%-32s %10.4fs %10.4fs %7.2fx  %s" % (name, t0, t1, ratio, \
+				"REGRESSION" if regressed else "")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Benchmarks the sieves and the factoring routines.")
+	parser.add_argument("-o", "--output", help = "file to write the results to (as JSON)")
+	parser.add_argument("-b", "--baseline", help = "results (as JSON) to compare against")
+	parser.add_argument("-q", "--quick", action = "store_true", help = "use smaller sieve limits and digit bands")
+	parser.add_argument("-s", "--seed", type = int, default = constants.BENCH_SEED)
+	parser.add_argument("-r", "--repeats", type = int, default = constants.BENCH_REPEATS)
+	parser.add_argument("-c", "--count", type = int, default = constants.BENCH_COUNT)
+	parser.add_argument("-t", "--tolerance", type = float, default = constants.BENCH_TOLERANCE)
+	parser.add_argument("--no-sieves", dest = "sieves", action = "store_false")
+	parser.add_argument("--no-routines", dest = "routines", action = "store_false")
+	args = parser.parse_args()
+
+	report = run(args.quick, args.seed, args.repeats, args.count, args.sieves, args.routines)
+	print_results(report)
+	if args.output:
+		with open(args.output, "w") as fp:
+			json.dump(report, fp, indent = 2, sort_keys = True)
+
+	if args.baseline:
+		with open(args.baseline) as fp:
+			baseline = json.load(fp)
+		rows = compare(report, baseline, args.tolerance)
+		print ""
+		print_comparison(rows)
+		if any(row[-1] for row in rows):
+			sys.exit(1)
@@ -5,17 +5,34 @@ File that contains constants tuned specifically for the factoring algorithms
 and the prime sieves. Tweakable if required. 
 """
 
+import os
+
 # Prime sieve constants
 SMALL_THRESHOLD = 60
 ERAT_THRESHOLD = 35 * 10**5
-ATKIN_THERSHOLD = 10**10
 LOWER_SEG_SIZE = 65536
 UPPER_SEG_SIZE = 2097152
+STREAM_SEG_SIZE = 10**6
+USE_NUMPY = True
+NUMPY_SEG_SIZE = 2**22
+
+# Prime table constants
+USE_PRIME_TABLE = True
+PRIME_TABLE_DIR = os.path.join(os.path.expanduser("~"), ".factor")
+PRIME_TABLE_MIN_LIMIT = 10**7
+PRIME_TABLE_BLOCK = 4096
+PRIME_TABLE_CHUNK = 10**7
 
 # Pollard rho constants
 PRIME_THRESHOLD_RHO = 500
 SIZE_THRESHOLD_RHO = 10**20
 
+# Small composite constants
+SIZE_THRESHOLD_SMALL = 10**18
+SIZE_THRESHOLD_LEHMAN = 2**42
+FERMAT_ITERATIONS = 64
+HART_ITERATIONS = 256
+
 # Pollard (p-1) constants
 MAX_B1_PM1 = 10**8
 MAX_B2_PM1 = 10**10
@@ -26,11 +43,61 @@ MAX_CURVES_ECM = 10000
 MAX_RND_ECM = 2**63
 MAX_B1_ECM = 43 * 10**7
 MAX_B2_ECM = 2 * 10**10
+MAX_B2_ECM_POLY = 4 * 10**12
+ECM_POLY_BLOCKS = 4
+ECM_CACHE_MAX_BYTES = 256 * 2**20
+ECM_CHECKPOINT_SECONDS = 60
+ECM_PRAC_MAX_B1 = 3 * 10**6
+ECM_PRAC_SAVE_MIN_B1 = 10**5
+ECM_BATCH_CURVES = 128
+
+# SIQS constants (parameters are digits, size of the factor base, half-width of the sieve interval)
+SIQS_PARAMETERS = [(30, 200, 65536), (35, 400, 196608), (40, 800, 393216), \
+				(45, 1500, 1572864), (50, 3000, 6291456), (55, 5000, 6291456), \
+				(60, 8000, 6291456), (65, 12000, 6291456), (70, 16000, 6291456), \
+				(80, 25000, 6291456), (90, 40000, 6291456)]
+SIQS_MIN_DIGITS = 22
+SIQS_MAX_DIGITS = 90
+SIQS_ECM_FRACTION = 0.35
+SIQS_MULTIPLIER_PRIMES = 1000
+SIQS_MIN_SIEVE_PRIME = 30
+SIQS_LARGE_PRIME_MULTIPLIER = 128
+SIQS_THRESHOLD_SLACK = 2
+SIQS_EXTRA_RELATIONS = 32
 
 # General factorization constants
 PRIME_THRESHOLD_BF = 25000
 
+# Engine scheduler constants (ECM levels are (B1, B2, curves) as recommended by GMP-ECM)
+RHO_SHORT_ITERATIONS = 2**12
+PM1_SCHEDULE_FACTOR = 5
+PM1_SCHEDULE_B2_RATIO = 20
+ECM_SCHEDULE = [(2000, 147396, 25), (11000, 1873422, 90), (50000, 12746592, 300), \
+				(250000, 128992510, 700), (1000000, 1045563762, 1800), \
+				(3000000, 5706890290, 5100)]
+
+# Factorization cache constants
+USE_FACTOR_CACHE = True
+FACTOR_CACHE_NAME = "factorizations.db"
+FACTOR_CACHE_SIZE = 100000
+FACTOR_CACHE_DISK_SIZE = 10**6
+FACTOR_CACHE_PRIMES = 10000
+
+# Batch factorization constants
+BATCH_CHUNK_SIZE = 1
+BATCH_TRIAL_SIZE = 1024
+USE_BATCH_GCD = True
+BATCH_GCD_SIZE = 16384
+
+# Benchmark constants
+BENCH_SEED = 2017
+BENCH_REPEATS = 3
+BENCH_COUNT = 3
+BENCH_TOLERANCE = 0.25
+
 # Names of factoring routines for displaying purposes
 NAME_ECM = "ECM"
 NAME_RHO = "Pollard Rho"
-NAME_PM1 = "Pollard p-1"
\ No newline at end of file
+NAME_PM1 = "Pollard p-1"
+NAME_SMALL = "SQUFOF/Hart/Lehman/Fermat"
+NAME_SIQS = "SIQS"
\ No newline at end of file
@@ -1,25 +1,47 @@
 # coding=utf-8
 
+import os
 import math
+import array
+import json
+import time
 import utils
+import events
 import random
+import multiprocessing
 import primeSieve
+import primeTable
+import polynomial
+import twistedEdwards
+import weierstrass
 import constants
-from decimal import Decimal
 
 """
 This module contains an implementation of a two-stage version Lenstra's elliptical 
 curve factorization method (ECM) with the usual stage 1 and stage 2 optimizations. 
 This implementation uses Suyama's paramterization to generate curves in Montgomery
-form and is inversionless.
+form and is inversionless. Stage 1 can also be done on the same curves in twisted Edwards
+form (see twistedEdwards.py), which takes fewer multiplications per bit of the scalar,
+or on a batch of them at once in affine Weierstrass form (see weierstrass.py), which 
+shares the modular inversions between the curves.
 """
 
 RESOLUTION = 40
+CHECKPOINT_VERSION = 1
 
-def compute_bounds(n):
+# Name of the files stage 1 programs are saved in (next to the prime table), along with the
+# version of their format
+CHAINS_NAME = "prac-%d-%d.bin"
+CHAINS_VERSION = 1
+
+# Curve models stage 1 can be done on
+MONTGOMERY, EDWARDS, AFFINE = "montgomery", "edwards", "affine"
+
+def compute_bounds(n, use_poly_stage2 = False):
 	"""
 	Computes Stage 1 and Stage 2 bounds for both ECM. This almost  coincides with GMP-ECM's 
-	bounds for the same but are clipped because of prime sieve limitations. 
+	bounds for the same but are clipped because of prime sieve limitations. The polynomial
+	stage 2 doesn't need the primes below B2 so B2 is allowed to be a lot larger with it.
 	Reference:
 	http://www.mersennewiki.org/index.php/Elliptic_Curve_Method	
 	"""
@@ -37,8 +59,11 @@ def compute_bounds(n):
 	elif log_n <= 80:
 		B1, B2 = 3000000, 5706890290
 	else: 
-		# Anything greater and my computer runs out of memory -- prolly need to fix this
+		# Stage 2 streams its primes so memory isn't an issue anymore but the bounds 
+		# are still clipped to keep the running time sane
 		B1, B2 = constants.MAX_B1_ECM, constants.MAX_B2_ECM
+		if use_poly_stage2:
+			B2 = constants.MAX_B2_ECM_POLY
 	return B1, B2
 
 
@@ -74,9 +99,10 @@ def point_double(px, pz, n, a24):
 	return x, z
 
 
-def scalar_multiply(k, px, pz, n, a24):
+def scalar_multiply(k, px, pz, n, a24, deadline = None):
 	"""
 	Multiplies a specified point P (in Montgomery form) by a specified scalar in E(Z\nZ).
+	Returns (None, None) if the deadline passes before it's done.
 	"""
 	sk = bin(k)
 	lk = len(sk)
@@ -84,6 +110,8 @@ def scalar_multiply(k, px, pz, n, a24):
 	rx, rz = point_double(px, pz, n, a24)
 
 	for i in xrange(3, lk):
+		if (i & 4095) == 0 and utils.expired(deadline):
+			return None, None
 		if sk[i] == '1':
 			qx, qz = point_add(rx, rz, qx, qz, px, pz, n)
 			rx, rz = point_double(rx, rz, n, a24)
@@ -98,191 +126,451 @@ def scalar_multiply(k, px, pz, n, a24):
 ADD_COST = 6
 DUP_COST = 5
 
-def lucas_cost(k, v):
-	d = k
-	r = int(Decimal(d) * Decimal(v) + Decimal(0.5))
-	if r >= k:
-		return ADD_COST * k
+# Values of v for the first step of PRAC (the golden ratio and others from GMP-ECM), the 
+# one giving the cheapest chain for each prime is used
+PRAC_MULTIPLIERS = [0.61803398874989485, 0.72360679774997897, 0.58017872829546410, \
+					0.63283980608870629, 0.61242994950949500, 0.62018198080741576, \
+					0.61721461653440386, 0.61752824061172562, 0.61807966846989581, \
+					0.61800800982066870]
+
+# Operations of a Lucas chain (see lucas_chain) and of a stage 1 program (see stage1_chains)
+SWAP, START, END, DOUBLE = 0, 10, 11, 12
 
+
+def lucas_chain(k, v, limit = None):
+	"""
+	Returns the operations of the Lucas chain PRAC builds for a specified odd prime 'k'
+	starting from r = kv, along with their cost (in multiplications), or None if that 
+	exceeds 'limit'. The operations are the rules of Montgomery's table (numbered 1 to 9), 
+	each of which shrinks the pair (d, e), and SWAP to exchange d and e.
+	"""
+	r = int(k * v + 0.5)
+	if r >= k:
+		return None
 	d, e, c = k - r, 2*r - k, DUP_COST + ADD_COST
+	ops = bytearray()
 	while d != e:
 		# Want d >= e so swap if d < e
 		if d < e:
 			d, e = e, d
-
-		# Condition 1
+			ops.append(SWAP)
 		if 4*d <= 5*e and (d + e) % 3 == 0:
 			d, e = (2*d - e) / 3, (2*e - d) / 3
 			c += 3 * ADD_COST
-		# Condition 2
-		elif 4*d <= 5*e and (d - e) % 6  == 0:
+			ops.append(1)
+		elif 4*d <= 5*e and (d - e) % 6 == 0:
 			d = (d - e) / 2
 			c += ADD_COST + DUP_COST
-		# Condition 3
+			ops.append(2)
 		elif d <= 4*e:
 			d -= e
 			c += ADD_COST
-		# Condition 4
+			ops.append(3)
 		elif (d + e) % 2 == 0:
 			d = (d - e) / 2
 			c += ADD_COST + DUP_COST
-		# Condition 5
+			ops.append(4)
 		elif d % 2 == 0:
 			d /= 2
 			c += ADD_COST + DUP_COST
-		# Condition 6
+			ops.append(5)
 		elif d % 3 == 0:
 			d = d/3 - e
 			c += 3*ADD_COST + DUP_COST
-		# Condition 7
+			ops.append(6)
 		elif (d + e) % 3 == 0:
 			d = (d - 2*e) / 3
 			c += 3*ADD_COST + DUP_COST
-		# Condition 8
+			ops.append(7)
 		elif (d - e) % 3 == 0:
 			d = (d - e) / 3
 			c += 3*ADD_COST + DUP_COST
-		# Condition 9
+			ops.append(8)
 		else:
 			e /= 2
 			c += ADD_COST + DUP_COST
+			ops.append(9)
+		if limit is not None and c >= limit:
+			return None
+	return ops, c
 
-	return c
 
+def prac_chain(k):
+	"""
+	Returns the cheapest Lucas chain PRAC finds for a specified odd prime over the values
+	in PRAC_MULTIPLIERS.
+	"""
+	best, cost = None, None
+	for v in PRAC_MULTIPLIERS:
+		chain = lucas_chain(k, v, cost)
+		if chain is not None:
+			best, cost = chain
+	return best
 
-def multiply_prac(k, px, pz, n, a24):
-	ax, bx, cx, tx, t2x = px, 0, 0, 0, 0
-	az, bz, cz, tz, t2z = pz, 0, 0, 0, 0
-	v = [0.61803398874989485, 0.5801787282954641, 0.6179144065288179 , 0.6180796684698958]
-
-	# Find best value of v
-	r, i = lucas_cost(k, v[0]), 0
-	for d in xrange(len(v)):
-		e = lucas_cost(k, v[d])
-		if e < r:
-			r, i = e, d
-
-	r = int(Decimal(k) * Decimal(v[i]) + Decimal(0.5))
-	d, e = k - r, 2*r - k
-	bx, bz, cx, cz = ax, az, ax, az
-	ax, az = point_double(ax, az, n, a24)
-	
-	while d != e:
-		# Want d >= e so swap if d < e
-		if d < e:
-			d, e = e, d
-			ax, az, bx, bz = bx, bz, ax, az
 
-		# Condition 1
-		if 4*d <= 5*e and (d + e) % 3 == 0:
-			d, e = (2*d - e) / 3, (2*e - d) / 3
-			tx, tz = point_add(ax, az, bx, bz, cx, cz, n)
-			t2x, t2z = point_add(tx, tz, ax, az, bx, bz, n)
-			bx, bz = point_add(bx, bz, tx, tz, ax, az, n)
-			ax, az, t2x, t2z = t2x, t2z, ax, az
-		# Condition 2
-		elif 4*d <= 5*e and (d - e) % 6  == 0:
-			d = (d - e) / 2
-			bx, bz = point_add(ax, az, bx, bz, cx, cz, n)
-			ax, az = point_double(ax, az, n, a24)
-		# Condition 3 
-		elif d <= 4*e:
-			d -= e
-			# tx, tz = point_add(bx, bz, ax, az, cx, cz, n)
-			# bx, tx, cx = tx, cx, bx
-			# bz, tz, cz = tz, cz, bz
-			cx, cz = point_add(bx, bz, ax, az, cx, cz, n)
-			bx, bz, cx, cz = cx, cz, bx, bz
-		# Condition 4
-		elif (d + e) % 2 == 0:
-			d = (d - e) / 2
-			bx, bz = point_add(bx, bz, ax, az, cx, cz, n)
-			ax, az = point_double(ax, az, n, a24)
-		# Condition 5
-		elif d % 2 == 0:
-			d /= 2
-			cx, cz = point_add(cx, cz, ax, az, bx, bz, n)
-			ax, az = point_double(ax, az, n, a24)
-		# Condition 6
-		elif d % 3 == 0:
-			d = d/3 - e
-			tx, tz = point_double(ax, az, n, a24)
-			t2x, t2z = point_add(ax, az, bx, bz, cx, cz, n)
-			ax, az = point_add(tx, tz, ax, az, ax, az, n)
-			# tx, tz = point_add(tx, tz, t2x, t2z, cx, cz, n)
-			# cx, bx, tx = bx, tx, cx
-			# cz, bz, tz = bz, tz, cz
-			cx, cz = point_add(tx, tz, t2x, t2z, cx, cz, n)
-			bx, bz, cx, cz = cx, cz, bx, bz
-		# Condition 7
-		elif (d + e) % 3 == 0:
-			d = (d - 2*e) / 3
-			tx, tz = point_add(ax, az, bx, bz, cx, cz, n)
-			bx, bz = point_add(tx, tz, ax, az, bx, bz, n)
-			tx, tz = point_double(ax, az, n, a24)
-			# TODO: Check order of a and t here
-			ax, az = point_add(ax, az, tx, tz, ax, az, n)
-		# Condition 8
-		elif (d - e) % 3 == 0:
-			d = (d - e) / 3
-			tx, tz = point_add(ax, az, bx, bz, cx, cz, n)
-			# TODO: Check whether c = f(a, c, b) or c = f(c, a, b)
-			cx, cz = point_add(cx, cz, ax, az, bx, bz, n)
-			bx, bz, tx, tz = tx, tz, bx, bz
-			tx, tz = point_double(ax, az, n, a24)
-			# TODO: Check order of a and t here
-			ax, az = point_add(ax, az, tx, tz, ax, az, n)
-		# Condition 9
+def run_program(program, px, pz, n, a24, deadline = None):
+	"""
+	Multiplies a specified point P (in Montgomery form) by the scalar a stage 1 program
+	encodes (see stage1_chains). Each prime is multiplied in with Montgomery's PRAC [1],
+	which keeps three points A, B and C = A - B and ends with A + B. 
+	Returns (None, None) if the deadline passes before it's done.
+
+	REFERENCES:
+	[1] P.L. Montgomery; Evaluating recurrences of form X_{m+n} = f(X_m, X_n, X_{m-n}) via
+	    Lucas chains; Unpublished manuscript (1983)
+	"""
+	add, dup = point_add, point_double
+	ax, az = px, pz
+	bx = bz = cx = cz = 0
+	check = 4096
+	for i, op in enumerate(program):
+		if op == SWAP:
+			ax, az, bx, bz = bx, bz, ax, az
+		elif op == 3:
+			# (B, C) = (f(B, A, C), B)
+			tx, tz = add(bx, bz, ax, az, cx, cz, n)
+			bx, bz, cx, cz = tx, tz, bx, bz
+		elif op == START:
+			bx, bz, cx, cz = ax, az, ax, az
+			ax, az = dup(ax, az, n, a24)
+		elif op == END:
+			ax, az = add(ax, az, bx, bz, cx, cz, n)
+			if i >= check:
+				if utils.expired(deadline):
+					return None, None
+				check = i + 4096
+		elif op == 1:
+			tx, tz = add(ax, az, bx, bz, cx, cz, n)
+			t2x, t2z = add(tx, tz, ax, az, bx, bz, n)
+			bx, bz = add(bx, bz, tx, tz, ax, az, n)
+			ax, az = t2x, t2z
+		elif op == 2:
+			bx, bz = add(ax, az, bx, bz, cx, cz, n)
+			ax, az = dup(ax, az, n, a24)
+		elif op == 4:
+			bx, bz = add(bx, bz, ax, az, cx, cz, n)
+			ax, az = dup(ax, az, n, a24)
+		elif op == 5:
+			cx, cz = add(cx, cz, ax, az, bx, bz, n)
+			ax, az = dup(ax, az, n, a24)
+		elif op == 6:
+			tx, tz = dup(ax, az, n, a24)
+			t2x, t2z = add(ax, az, bx, bz, cx, cz, n)
+			ax, az = add(tx, tz, ax, az, ax, az, n)
+			tx, tz = add(tx, tz, t2x, t2z, cx, cz, n)
+			bx, bz, cx, cz = tx, tz, bx, bz
+		elif op == 7:
+			tx, tz = add(ax, az, bx, bz, cx, cz, n)
+			bx, bz = add(tx, tz, ax, az, bx, bz, n)
+			tx, tz = dup(ax, az, n, a24)
+			ax, az = add(ax, az, tx, tz, ax, az, n)
+		elif op == 8:
+			tx, tz = add(ax, az, bx, bz, cx, cz, n)
+			cx, cz = add(cx, cz, ax, az, bx, bz, n)
+			bx, bz = tx, tz
+			tx, tz = dup(ax, az, n, a24)
+			ax, az = add(ax, az, tx, tz, ax, az, n)
+		elif op == 9:
+			cx, cz = add(cx, cz, bx, bz, ax, az, n)
+			bx, bz = dup(bx, bz, n, a24)
 		else:
-			e /= 2
-			cx, cz = point_add(cx, cz, bx, bz, ax, az, n)
-			bx, bz = point_double(bx, bz, n, a24)
-	
-	x, z = point_add(ax, az, bx, bz, cx, cz, n)
-	return x, z
+			ax, az = dup(ax, az, n, a24)
+	return ax, az
+
+
+def multiply_prac(k, px, pz, n, a24):
+	"""
+	Multiplies a specified point P (in Montgomery form) by a specified prime with PRAC.
+	"""
+	if k == 2:
+		return point_double(px, pz, n, a24)
+	return run_program(bytearray([START]) + prac_chain(k) + bytearray([END]), px, pz, n, a24)
 
 
 ###########################################################
 
 
-def factorize_ecm(n, verbose = False):
+def stage1_chains(B1, deadline = None):
 	"""
-	ECM algorithm
+	Returns the stage 1 program for a specified bound, i.e. the operations which multiply 
+	a point by the B1-powersmooth integer (see stage1_scalar) prime by prime: a doubling 
+	for each power of 2 and the cheapest PRAC chain of every odd prime p below B1 (between
+	START and END) repeated for each power of p. This takes about 18-20% fewer
+	multiplications than the Montgomery ladder over the bits of the whole scalar.
+	Returns None if the deadline passes before it's done.
 	"""
-	if n == 1 or utils.is_prime(n):
-		return n
-        
-	B1, B2 = compute_bounds(n)
-	if verbose:
-		print "Number of digits:", len(str(n))
-		print "Bounds:", B1, B2
+	log_B1 = math.log(B1)
+	program = bytearray([DOUBLE]) * int(log_B1/math.log(2))
+	for i, p in enumerate(primeTable.prime_range(3, B1)):
+		if (i & 1023) == 0 and utils.expired(deadline):
+			return None
+		p = int(p)
+		chain = bytearray([START]) + prac_chain(p) + bytearray([END])
+		program += chain * int(log_B1/math.log(p))
+	return program
+
+
+def load_chains(B1, deadline = None):
+	"""
+	Returns the stage 1 program for a specified bound (see stage1_chains). Working it out
+	takes about as long as a curve, so for B1 of at least ECM_PRAC_SAVE_MIN_B1 it's saved 
+	next to the prime table and later runs (and other processes) read it from there. 
+	Returns None if the deadline passes before it's worked out.
+	"""
+	save = B1 >= constants.ECM_PRAC_SAVE_MIN_B1
+	path = os.path.join(constants.PRIME_TABLE_DIR, CHAINS_NAME % (CHAINS_VERSION, B1))
+	if save and os.path.exists(path):
+		try:
+			with open(path, "rb") as fp:
+				return bytearray(fp.read())
+		except EnvironmentError:
+			pass
+
+	program = stage1_chains(B1, deadline)
+	if program is not None and save:
+		# Written to a temporary file first so that concurrent readers never see part of it
+		tmp = path + "." + str(os.getpid()) + ".tmp"
+		try:
+			if not os.path.isdir(constants.PRIME_TABLE_DIR):
+				os.makedirs(constants.PRIME_TABLE_DIR)
+			with open(tmp, "wb") as fp:
+				fp.write(program)
+			os.rename(tmp, path)
+		except EnvironmentError:
+			pass
+	return program
+
+
+def stage1_scalar(B1):
+	"""
+	Computes a B1-powersmooth integer 'k', i.e. the product of the largest powers of the 
+	primes below B1 which don't exceed B1. 
+	"""
+	log_B1 = math.log(B1)
+	factors = [pow(p, int(log_B1/math.log(p))) for p in primeTable.prime_range(2, B1)]
+	# Multiply the prime powers pairwise (rather than one at a time) so that most of the
+	# work is done by multiplications of numbers of similar size
+	while len(factors) > 1:
+		factors = [factors[i] * factors[i+1] if i + 1 < len(factors) else factors[i] \
+					for i in xrange(0, len(factors), 2)]
+	return factors[0] if factors else 1
 
-	D = int(math.sqrt(B2))
-	beta = [0] * (D+1)
-	S = [0] * (2*D + 2)
 
-	# ----- Stage 1 and Stage 2 precomputations -----
-	curves, log_B1 = 0, math.log(B1)
+def _artifact_size(artifact):
+	"""
+	Returns the (approximate) number of bytes taken up by a stage 1 scalar or a list of 
+	arrays of stage 2 primes.
+	"""
+	if isinstance(artifact, list):
+		return sum(segment.itemsize * len(segment) for segment in artifact)
+	if isinstance(artifact, bytearray):
+		return len(artifact)
+	if isinstance(artifact, array.array):
+		return artifact.itemsize * len(artifact)
+	return artifact.bit_length() >> 3
 
-	if verbose: print "Sieving primes..."
-	primes = primeSieve.prime_sieve(B2)
 
-	num_primes = len(primes)
-	idx_B1 = utils.binary_search(B1, primes)
-	
-	# Compute a B1-powersmooth integer 'k'
-	k = 1
-	for i in xrange(idx_B1):
-		p = primes[i]
-		k = k * pow(p, int(log_B1/math.log(p)))
+# Stage 1 scalars and stage 2 primes for the bounds used so far
+_bounds_cache = utils.LRUCache(constants.ECM_CACHE_MAX_BYTES, _artifact_size)
+
+
+def bound_artifacts(B1, B2, stage2_primes = True, model = MONTGOMERY, deadline = None):
+	"""
+	Returns the precomputation which only depends on the bounds, i.e. the stage 1 program
+	(see load_chains) or, for B1 above ECM_PRAC_MAX_B1 or if the deadline passes before
+	the program is worked out, the B1-powersmooth scalar 'k' (the non-adjacent form of that
+	scalar for Edwards and affine curves) and the primes in (B1, B2) for stage 2 as a list
+	of arrays. The primes are None if they can be streamed from the
+	prime table instead, if they wouldn't fit in the cache (they're sieved as stage 2 goes
+	then) or if they aren't needed at all.
+	These are kept in an LRU cache (capped at ECM_CACHE_MAX_BYTES) so repeated calls with 
+	the same bounds -- e.g. for the cofactors of a number -- only pay for them once.
+	"""
+	k = _bounds_cache.get((model, B1))
+	if k is None:
+		if model != MONTGOMERY:
+			k = stage1_scalar(B1)
+			k = twistedEdwards.naf(k, twistedEdwards.naf_width(k.bit_length()))
+		elif B1 <= constants.ECM_PRAC_MAX_B1:
+			k = load_chains(B1, deadline)
+		else:
+			k = stage1_scalar(B1)
+		if k is not None:
+			_bounds_cache.put((model, B1), k)
+		else:
+			# Out of time for the program so this run makes do with the ladder (which isn't
+			# cached so that later runs still get the program)
+			k = stage1_scalar(B1)
+
+	segments = None
+	if stage2_primes and primeTable.table_for(B2 - 1) is None:
+		segments = _bounds_cache.get(("primes", B1, B2))
+		# The primes are only held in memory if they'd fit in the cache (there are fewer
+		# than x/ln(x) * (1 + 1.2762/ln(x)) primes below x); otherwise stage 2 sieves them
+		# segment by segment
+		log_B2 = math.log(max(B2, 3))
+		count = B2 / log_B2 * (1 + 1.2762 / log_B2)
+		if segments is None and count * array.array('l').itemsize <= constants.ECM_CACHE_MAX_BYTES:
+			segments = list(primeSieve.prime_segments(B1 + 1, B2 - 1))
+			_bounds_cache.put(("primes", B1, B2), segments)
+	return k, segments
+
+
+def stage2(qx, qz, n, a24, B1, B2, segments = None, deadline = None):
+	"""
+	Stage 2 with prime pairing. The giant steps m are multiples of 210 spaced 2*D apart 
+	(where D is an odd multiple of 105 close to √B2) and the baby steps are the odd d < D
+	coprime to 210. Every prime q in (m - D, m + D) is written as q = m ± d and since
+	mQ = ±dQ have the same x-coordinate, a single product (x_m*z_d - x_d*z_m) covers both 
+	m - d and m + d whenever both of them are prime. Choosing m ≡ 0 (mod 210) makes m - d 
+	and m + d coprime to 210 at the same time, which makes such pairs a lot more common.
+	Returns the accumulated product (whose GCD with 'n' may reveal a factor) along with
+	whether it covers all of the primes (False if the deadline passed first).
+	"""
+	D = 105 * (2 * int(math.sqrt(B2) / 210) + 1)
+	G = 2 * D
+	X, Z, beta = [0] * D, [0] * D, [0] * D
+
+	# Baby steps: dQ for odd d < D 
+	X[1], Z[1] = qx, qz
+	q2x, q2z = point_double(qx, qz, n, a24)
+	X[3], Z[3] = point_add(q2x, q2z, qx, qz, qx, qz, n)
+	for d in xrange(5, D, 2):
+		X[d], Z[d] = point_add(X[d-2], Z[d-2], q2x, q2z, X[d-4], Z[d-4], n)
+	baby = [d for d in xrange(1, D, 2) if d % 3 and d % 5 and d % 7]
+	for d in baby:
+		beta[d] = (X[d] * Z[d]) % n
+
+	# Giant steps: the current one (mQ) and the next one ((m + G)Q)
+	m = 210 * ((B1 + D) / 210)
+	mx, mz = scalar_multiply(m, qx, qz, n, a24)
+	nx, nz = scalar_multiply(m + G, qx, qz, n, a24)
+	gx, gz = scalar_multiply(G, qx, qz, n, a24)
+
+	g, pending, paired = 1, bytearray(D), []
+
+	# Stream the primes in (B1, B2) segment by segment
+	if segments is None:
+		segments = primeTable.prime_segments(B1 + 1, B2 - 1)
+	for segment in segments:
+		for q in segment:
+			while q > m + D:
+				# Accumulate the products for the current giant step and move on
+				alpha = (mx * mz) % n
+				for d in paired:
+					f = (mx - X[d]) * (mz + Z[d]) - alpha + beta[d]
+					g = (g * f) % n
+					pending[d] = 0
+				paired = []
+				if utils.expired(deadline):
+					return g, False
+				tx, tz = point_add(nx, nz, gx, gz, mx, mz, n)
+				mx, mz, nx, nz = nx, nz, tx, tz
+				m += G
+			d = q - m if q > m else m - q
+			if not pending[d]:
+				pending[d] = 1
+				paired.append(d)
+
+	alpha = (mx * mz) % n
+	for d in paired:
+		f = (mx - X[d]) * (mz + Z[d]) - alpha + beta[d]
+		g = (g * f) % n
+	return g, True
+
+
+def stage2_poly(qx, qz, n, a24, B1, B2, deadline = None):
+	"""
+	Stage 2 with the FFT continuation [1]. The x-coordinates of the baby steps dQ (the odd
+	d < D coprime to 210) are the roots of a polynomial F and the giant steps mQ (multiples
+	of 210 spaced 2*D apart) are handled in blocks as deg(F) roots of polynomials G_i. Then
+	H = prod(G_i) mod F vanishes at a root of F modulo p iff mQ = ±dQ (mod p) for some m, d,
+	i.e. iff (m ± d)Q is the point at infinity, so evaluating H at the roots of F (with a 
+	remainder tree) covers every prime in (B1, B2) -- without ever listing them -- in time
+	which grows far slower than the number of primes below B2.
+	Returns the accumulated product (whose GCD with 'n' may reveal a factor) along with
+	whether it covers all of the giant steps (False if the deadline passed first).
+
+	Reference:
+	[1] P.L. Montgomery, R.D. Silverman; An FFT Extension to the P-1 Factoring Algorithm;
+	    Mathematics of Computation, 54-190: 839-854
+	"""
+	# Balance the giant steps (B2/2D) against ECM_POLY_BLOCKS blocks of deg(F) ≈ 0.229*D
+	D = 105 * (2 * int(math.sqrt(B2 / (0.458 * constants.ECM_POLY_BLOCKS)) / 210) + 1)
+	G = 2 * D
+	X, Z = [0] * D, [0] * D
+
+	# Baby steps: dQ for odd d < D, made affine with a single inversion
+	X[1], Z[1] = qx, qz
+	q2x, q2z = point_double(qx, qz, n, a24)
+	X[3], Z[3] = point_add(q2x, q2z, qx, qz, qx, qz, n)
+	for d in xrange(5, D, 2):
+		X[d], Z[d] = point_add(X[d-2], Z[d-2], q2x, q2z, X[d-4], Z[d-4], n)
+	baby = [d for d in xrange(1, D, 2) if d % 3 and d % 5 and d % 7]
+	inverses, g = utils.batch_inverse([Z[d] for d in baby], n)
+	if inverses is None:
+		return g, True
+	tree = polynomial.product_tree([(X[d] * inverses[i]) % n for i, d in enumerate(baby)], n)
+	F, L = tree[-1][0], len(baby)
+	F_inv = polynomial.inverse(F[::-1], L, n)
+
+	# Giant steps: the current one (mQ) and the next one ((m + G)Q)
+	m = 210 * ((B1 + D) / 210)
+	mx, mz = scalar_multiply(m, qx, qz, n, a24)
+	nx, nz = scalar_multiply(m + G, qx, qz, n, a24)
+	gx, gz = scalar_multiply(G, qx, qz, n, a24)
+
+	H = [1]
+	while m - D < B2 and not utils.expired(deadline):
+		xs, zs = [], []
+		while len(zs) < L and m - D < B2:
+			xs.append(mx)
+			zs.append(mz)
+			tx, tz = point_add(nx, nz, gx, gz, mx, mz, n)
+			mx, mz, nx, nz = nx, nz, tx, tz
+			m += G
+		inverses, g = utils.batch_inverse(zs, n)
+		if inverses is None:
+			return g, True
+		G_i = polynomial.from_roots([(x * inv) % n for x, inv in zip(xs, inverses)], n)
+		H = polynomial.remainder(polynomial.multiply(H, G_i, n), F, n, F_inv)
 
 	g = 1
-	while (g == 1 or g == n) and curves <= constants.MAX_CURVES_ECM:
-		curves += 1
-		sigma = random.randint(6, constants.MAX_RND_ECM)
-		if verbose and curves % RESOLUTION == 0: 
-			print "Tried", curves, "random curves..."
+	for value in polynomial.evaluate(H, tree, n):
+		g = (g * value) % n
+	return g, m - D >= B2
+
 
+def run_curve(n, sigma, k, B1, B2, segments = None, use_poly_stage2 = False, deadline = None, \
+				model = MONTGOMERY):
+	"""
+	Runs stage 1 and stage 2 of ECM on the curve generated by a specified value of sigma.
+	Returns the GCD found along with the stage it was found in (0 if the curve failed and
+	-1 if it was cut short by the deadline). 'k' is the stage 1 program, scalar or 
+	non-adjacent form (see bound_artifacts) for the curve model.
+	The stage 2 primes are streamed from the prime table unless given as 'segments' (and 
+	aren't needed at all with the polynomial stage 2).
+	"""
+	# Stage timings are only taken if anyone's listening
+	timed = events.enabled()
+	if timed:
+		t = time.time()
+
+	# ----- Stage 1 -----
+	if model == EDWARDS:
+		curve, g = twistedEdwards.suyama_curve(sigma, n)
+		if curve is not None:
+			a, d, x, y, a24 = curve
+			table, g = twistedEdwards.odd_multiples(x, y, twistedEdwards.table_size(k), n, a, d)
+		if g != 1:
+			# A number that had to be inverted shares a factor with n
+			return (g, 1) if g != n else (n, 0)
+		X, Y, Z = twistedEdwards.scalar_multiply(k, table, n, a, deadline)
+		if X is None:
+			return 1, -1
+		# Move to the Montgomery form of the curve for stage 2
+		qx, qz = (Z + Y) % n, (Z - Y) % n
+	else:
 		# Generate a new random curve in Montgomery form with Suyama's parametrization
 		u = ((sigma * sigma) - 5) % n
 		v = (4 * sigma) % n
@@ -290,49 +578,322 @@ def factorize_ecm(n, verbose = False):
 		A = ((vmu*vmu*vmu) * (3*u + v) / (4*u*u*u*v) - 2) % n
 		a24 = (A+2) / 4
 
-		# ----- Stage 1 -----
 		px, pz = ((u*u*u) / (v*v*v)) % n, 1
-		qx, qz = scalar_multiply(k, px, pz, n, a24)
-		g = utils.gcd(n, qz)
-
-		# If stage 1 is successful, return a non-trivial factor else
-		# move on to stage 2
+		if isinstance(k, bytearray):
+			qx, qz = run_program(k, px, pz, n, a24, deadline)
+		else:
+			qx, qz = scalar_multiply(k, px, pz, n, a24, deadline)
+		if qx is None:
+			return 1, -1
+	g = utils.gcd(n, qz)
+	found = g != 1 and g != n
+	if timed:
+		t1 = time.time()
+		events.emit("stage", "ecm", n = n, stage = 1, elapsed = t1 - t, \
+					found = g if found else None)
+
+	# If stage 1 is successful, return a non-trivial factor else
+	# move on to stage 2
+	if found:
+		return g, 1
+
+	# ----- Stage 2 -----
+	if use_poly_stage2:
+		g, finished = stage2_poly(qx, qz, n, a24, B1, B2, deadline)
+	else:
+		g, finished = stage2(qx, qz, n, a24, B1, B2, segments, deadline)
+	g = utils.gcd(n, g)
+	found = g != 1 and g != n
+	if timed:
+		events.emit("stage", "ecm", n = n, stage = 2, elapsed = time.time() - t1, \
+					found = g if found else None)
+	if found:
+		return g, 2
+	return g, 0 if finished else -1
+
+
+def run_batch(n, sigmas, k, B1, B2, segments = None, use_poly_stage2 = False, deadline = None):
+	"""
+	Runs stage 1 of ECM on the curves generated by the specified values of sigma in
+	lockstep (in affine Weierstrass coordinates, sharing the modular inversions) and then
+	stage 2 on each of them. 'k' is the non-adjacent form of the stage 1 scalar. Returns
+	the GCD found along with the stage it was found in as run_curve does.
+	"""
+	timed = events.enabled()
+	if timed:
+		t = time.time()
+
+	# ----- Stage 1 -----
+	montgomery, curves = [], []
+	for sigma in sigmas:
+		curve, g = twistedEdwards.suyama_montgomery(sigma, n)
+		if curve is not None:
+			A, B, x, a24 = curve
+			w, g = weierstrass.from_montgomery(A, B, x, n)
+		if g != 1:
+			if g != n:
+				return g, 1
+			continue
+		montgomery.append(curve)
+		curves.append(w)
+	points, g = weierstrass.scalar_multiply(k, curves, n, deadline)
+	if g == -1:
+		return 1, -1
+	if timed:
+		t1 = time.time()
+		events.emit("stage", "ecm", n = n, stage = 1, elapsed = t1 - t, \
+					found = g if g != 1 else None)
+	if g != 1:
+		return g, 1
+
+	# ----- Stage 2 -----
+	for (A, B, _, a24), point in zip(montgomery, points):
+		if point is None:
+			continue
+		# Move to the Montgomery form of the curve for stage 2
+		qx, qz = (3 * B * point[0] - A) % n, 3
+		if use_poly_stage2:
+			g, finished = stage2_poly(qx, qz, n, a24, B1, B2, deadline)
+		else:
+			g, finished = stage2(qx, qz, n, a24, B1, B2, segments, deadline)
+		g = utils.gcd(n, g)
 		if g != 1 and g != n:
-			print "Stage 1 found factor!"
-			return g
-
-		# ----- Stage 2 -----
-		S[1], S[2] = point_double(qx, qz, n, a24)
-		S[3], S[4] = point_double(S[1], S[2], n, a24)
-		beta[1] = (S[1] * S[2]) % n
-		beta[2] = (S[3] * S[4]) % n
-		for d in xrange(3, D+1):
-			d2 = 2 * d
-			S[d2-1], S[d2] = point_add(S[d2-3], S[d2-2], S[1], S[2], S[d2-5], S[d2-4], n)
-			beta[d] = (S[d2-1] * S[d2]) % n
-
-		g, B = 1, B1 - 1
-
-		rx, rz = scalar_multiply(B, qx, qz, n, a24)
-		tx, tz = scalar_multiply(B - 2*D, qx, qz, n, a24)
-		q, step = idx_B1, 2*D
-
-		for r in xrange(B, B2, step):
-			alpha, limit = (rx * rz) % n, r + step
-			while q < num_primes and primes[q] <= limit:
-				d = (primes[q] - r) / 2
-				f = (rx - S[2*d-1]) * (rz + S[2*d]) - alpha + beta[d]
-				g = (g * f) % n
-				q += 1
-			trx, trz = rx, rz
-			rx, rz = point_add(rx, rz, S[2*D-1], S[2*D], tx, tz, n)
-			tx, tz = trx, trz
+			break
+		if not finished:
+			return 1, -1
+	found = g != 1 and g != n
+	if timed:
+		events.emit("stage", "ecm", n = n, stage = 2, elapsed = time.time() - t1, \
+					found = g if found else None)
+	return (g, 2) if found else (g, 0)
+
+
+def _curve_worker(n, k, B1, B2, segments, use_poly_stage2, seed, max_curves, deadline, stop, \
+					results, model = MONTGOMERY):
+	"""
+	Runs random curves in a worker process until a factor is found, the curves run out, the
+	deadline passes or another worker signals that it found a factor. Puts the factor found (or -1) and the 
+	number of curves tried on the results queue.
+	"""
+	# Listeners were inherited from the parent and would only see this process' events
+	events.clear()
+	rng = random.Random(seed)
+	curves = 0
+	while curves < max_curves and not stop.is_set() and not utils.expired(deadline):
+		if model == AFFINE:
+			size = min(constants.ECM_BATCH_CURVES, max_curves - curves)
+			sigmas = [rng.randint(6, constants.MAX_RND_ECM) for _ in xrange(size)]
+			g, stage = run_batch(n, sigmas, k, B1, B2, segments, use_poly_stage2, deadline)
+		else:
+			size, sigma = 1, rng.randint(6, constants.MAX_RND_ECM)
+			g, stage = run_curve(n, sigma, k, B1, B2, segments, use_poly_stage2, deadline, \
+									model)
+		if stage == -1:
+			break
+		curves += size
+		if stage > 0:
+			results.put((g, curves))
+			return
+	results.put((-1, curves))
+
+
+def factorize_ecm_parallel(n, B1, B2, workers, verbose = False, use_poly_stage2 = False, \
+							deadline = None, max_curves = constants.MAX_CURVES_ECM + 1, \
+							model = MONTGOMERY):
+	"""
+	Runs (at most 'max_curves') ECM curves on several processes at once. The bound 
+	precomputation is done once before the workers are forked (so they share it) and every
+	worker is cancelled as soon as any of them finds a non-trivial factor. Returns the 
+	factor found (or -1) along with the number of curves tried.
+	"""
+	k, segments = bound_artifacts(B1, B2, not use_poly_stage2, model, deadline)
+	stop, results = multiprocessing.Event(), multiprocessing.Queue()
+	procs = []
+	for i in xrange(workers):
+		quota = max_curves / workers + (1 if i < max_curves % workers else 0)
+		seed = random.randint(0, constants.MAX_RND_ECM)
+		procs.append(multiprocessing.Process(target = _curve_worker, \
+						args = (n, k, B1, B2, segments, use_poly_stage2, seed, quota, \
+								deadline, stop, results, model)))
+
+	g, curves = -1, 0
+	try:
+		for proc in procs:
+			proc.daemon = True
+			proc.start()
+		for _ in xrange(workers):
+			h, c = results.get()
+			curves += c
+			if h != -1:
+				g = h
+				break
+	finally:
+		stop.set()
+		for proc in procs:
+			proc.terminate()
+			proc.join()
 
-		g = utils.gcd(n, g)
+	if verbose:
+		print "Tried", curves, "random curves on", workers, "processes..."
+	return g, curves
+
+
+def save_checkpoint(path, state):
+	"""
+	Writes the state of an ECM run to a checkpoint file. The state is written to a 
+	temporary file first and then moved into place so that a run killed while writing
+	never leaves a corrupt checkpoint behind.
+	"""
+	tmp = path + "." + str(os.getpid()) + ".tmp"
+	with open(tmp, "w") as fp:
+		json.dump(state, fp)
+	os.rename(tmp, path)
+
+
+def load_checkpoint(path):
+	"""
+	Returns the state of an ECM run saved in a checkpoint file or None if there is no 
+	such file.
+	"""
+	if not os.path.exists(path):
+		return None
+	with open(path) as fp:
+		state = json.load(fp)
+	if state.get("version") != CHECKPOINT_VERSION:
+		raise ValueError("Unsupported ECM checkpoint: " + path)
+	return state
+
+
+def factorize_ecm(n, verbose = False, workers = 1, use_poly_stage2 = False, checkpoint = None, \
+					deadline = None, bounds = None, max_curves = None, model = MONTGOMERY):
+	"""
+	ECM algorithm. Optionally runs curves on several processes at once ('workers' = None 
+	uses every CPU) and/or uses the polynomial (FFT continuation) stage 2, which allows
+	much larger B2 bounds.
+
+	The bounds (B1, B2) are derived from the size of 'n' unless specified as 'bounds' and
+	at most 'max_curves' curves (MAX_CURVES_ECM + 1 by default) are tried.
+
+	Stage 1 is done on Montgomery curves with PRAC unless 'model' is EDWARDS, in which case
+	it's done on the twisted Edwards form of the same curves with a windowed non-adjacent
+	form of the scalar (see twistedEdwards.py), or AFFINE, in which case ECM_BATCH_CURVES 
+	curves at a time are run through stage 1 together in affine Weierstrass form with one
+	modular inversion per step for the whole batch (see weierstrass.py).
+
+	If a 'deadline' (a time as returned by time.time()) is specified, no new curves are 
+	started after it passes and -1 is returned unless a factor was found by then.
+
+	If the path of a 'checkpoint' file is specified, the state of the run (the number, the
+	bounds, the seed of the sigmas and the number of curves done) is saved to it every
+	ECM_CHECKPOINT_SECONDS seconds and when the run ends. If the file already holds the
+	state of a run on the same number, the run picks up where that one stopped instead of
+	trying the same curves again (or returns its factor if it had found one).
+	"""
+	if n == 1 or utils.is_prime(n):
+		return n
+
+	state = None
+	if checkpoint is not None:
+		state = load_checkpoint(checkpoint)
+		if state is not None and state["n"] != n:
+			raise ValueError("Checkpoint " + checkpoint + " is for a different number")
+		if workers != 1:
+			raise ValueError("Checkpointing is only supported with a single worker")
+
+	if max_curves is None:
+		max_curves = constants.MAX_CURVES_ECM + 1
+	if state is None:
+		B1, B2 = bounds or compute_bounds(n, use_poly_stage2)
+		state = {"version": CHECKPOINT_VERSION, "n": n, "B1": B1, "B2": B2, \
+				"poly": use_poly_stage2, "seed": random.randint(0, constants.MAX_RND_ECM), \
+				"curves": 0, "factor": None, "model": model}
+	elif state["factor"] is not None:
+		return state["factor"]
+	B1, B2, use_poly_stage2 = state["B1"], state["B2"], state["poly"]
+	model = state.get("model", MONTGOMERY)
+	if verbose:
+		print "Number of digits:", len(str(n))
+		print "Bounds:", B1, B2
+	t = time.time()
+	events.emit("start", "ecm", n = n)
+	events.emit("bounds", "ecm", n = n, B1 = B1, B2 = B2)
+
+	if workers is None:
+		workers = multiprocessing.cpu_count()
+	if workers > 1:
+		g, curves = factorize_ecm_parallel(n, B1, B2, workers, verbose, use_poly_stage2, \
+											deadline, max_curves, model)
+		events.emit("end", "ecm", n = n, factor = g, elapsed = time.time() - t, \
+					curves = curves, workers = workers)
+		return g
+
+	# ----- Stage 1 and Stage 2 precomputations -----
+	if verbose: print "Sieving primes..."
+	k, segments = bound_artifacts(B1, B2, not use_poly_stage2, model, deadline)
+	t1 = time.time()
+	events.emit("stage", "ecm", n = n, stage = 0, elapsed = t1 - t, found = None)
+
+	# The sigmas come from their own generator so that a resumed run can replay the ones
+	# already used
+	rng = random.Random(state["seed"])
+	curves = state["curves"]
+	for _ in xrange(curves):
+		rng.randint(6, constants.MAX_RND_ECM)
+	if verbose and curves:
+		print "Resuming after", curves, "random curves..."
+
+	g, gcds, saved = -1, 0, t1
+	while curves < max_curves and not utils.expired(deadline):
+		if model == AFFINE:
+			size = min(constants.ECM_BATCH_CURVES, max_curves - curves)
+			sigmas = [rng.randint(6, constants.MAX_RND_ECM) for _ in xrange(size)]
+			h, stage = run_batch(n, sigmas, k, B1, B2, segments, use_poly_stage2, deadline)
+		else:
+			size, sigmas = 1, [rng.randint(6, constants.MAX_RND_ECM)]
+			h, stage = run_curve(n, sigmas[0], k, B1, B2, segments, use_poly_stage2, \
+									deadline, model)
+		if stage == -1:
+			# The curves weren't finished so they don't count
+			break
+		if verbose and (curves + size) / RESOLUTION > curves / RESOLUTION:
+			print "Tried", curves + size, "random curves..."
+		curves += size
+		gcds += 1 if stage == 1 else 1 + size
+		if events.enabled():
+			events.emit("curve", "ecm", n = n, curve = curves, sigma = sigmas[0], \
+						stage = stage, batch = size)
+		if stage:
+			if verbose:
+				print "Stage", stage, "found factor!"
+			g = h
+			break
+
+		if checkpoint is not None and time.time() - saved >= constants.ECM_CHECKPOINT_SECONDS:
+			state["curves"] = curves
+			save_checkpoint(checkpoint, state)
+			saved = time.time()
+
+	if checkpoint is not None:
+		# A run cut short by the deadline isn't over yet
+		finished = g != -1 or curves >= max_curves
+		state["curves"], state["factor"] = curves, g if finished else None
+		save_checkpoint(checkpoint, state)
 
 	# No non-trivial factor found, return -1
-	if curves > constants.MAX_CURVES_ECM:
-		return -1
-	else:
-		print "Stage 2 found factor!"
-		return g
\ No newline at end of file
+	events.emit("end", "ecm", n = n, factor = g, elapsed = time.time() - t, \
+				curves = curves, gcds = gcds)
+	return g
+
+
+def resume_ecm(checkpoint, verbose = False, deadline = None):
+	"""
+	Resumes the ECM run saved in a checkpoint file (see factorize_ecm).
+
+	Returns:
+		the factor found (or -1 if the run finished without finding one)
+	"""
+	state = load_checkpoint(checkpoint)
+	if state is None:
+		raise IOError("No ECM checkpoint at " + checkpoint)
+	return factorize_ecm(state["n"], verbose = verbose, use_poly_stage2 = state["poly"], \
+						checkpoint = checkpoint, deadline = deadline)
@@ -0,0 +1,127 @@
+# coding=utf-8
+
+"""
+This module contains a small event interface through which the factoring routines report
+what they're doing (bounds used, per-stage timings, curves tried, number of GCDs and which
+routine found each factor) to whoever is listening.
+
+A listener is any callable which takes a single event. Events are dictionaries with (at
+least) the keys "event" (the kind of event), "engine" (the routine emitting it) and "time"
+(when it was emitted) along with fields depending on the kind of event:
+
+    start  - n
+    bounds - n, B1, B2
+    stage  - n, stage, elapsed, found (factor found in the stage or None)
+    curve  - n, curve, sigma, stage (stage which found a factor or 0), batch (number of
+             curves run together, whose first sigma is given)
+    end    - n, factor (-1 if none), elapsed and counters such as curves or gcds
+    factor - n, factor (emitted by factor.factorize for every factor a routine finds)
+    prime  - n
+
+With no listeners attached emit() returns straight away and the routines skip the
+bookkeeping done only for events, so the cost is a function call per stage.
+
+NOTE: ECM curves run on worker processes (factorize_ecm with workers > 1) don't report
+per-curve events since listeners live in the parent process.
+
+Examples:
+	>>> recorder = events.Recorder()
+	>>> with events.listening(recorder):
+	...     factor.factorize((10**9 + 7) * (10**10 + 19))
+	>>> [e["engine"] for e in recorder.select("factor")]
+	>>> ['rho']
+"""
+
+import time
+
+# Listeners currently attached
+_listeners = []
+
+
+def subscribe(listener):
+	"""
+	Attaches a listener which is called with every event emitted from now on.
+	"""
+	_listeners.append(listener)
+
+
+def unsubscribe(listener):
+	"""
+	Detaches a listener attached with subscribe().
+	"""
+	_listeners.remove(listener)
+
+
+def clear():
+	"""
+	Detaches every listener.
+	"""
+	del _listeners[:]
+
+
+def enabled():
+	"""
+	Returns True if there is at least one listener attached.
+	"""
+	return bool(_listeners)
+
+
+def emit(event, engine, **fields):
+	"""
+	Sends an event to every listener attached.
+
+	Arguments:
+		event (:str) - the kind of event (e.g. "stage")
+		engine (:str) - the routine emitting the event (e.g. "ecm")
+		fields - the payload of the event
+	"""
+	if not _listeners:
+		return
+	fields["event"], fields["engine"], fields["time"] = event, engine, time.time()
+	for listener in list(_listeners):
+		listener(fields)
+
+
+class listening(object):
+	"""
+	Context manager which attaches a listener for the duration of a block.
+	"""
+	def __init__(self, listener):
+		self.listener = listener
+
+	def __enter__(self):
+		subscribe(self.listener)
+		return self.listener
+
+	def __exit__(self, *args):
+		unsubscribe(self.listener)
+		return False
+
+
+class Recorder(object):
+	"""
+	A listener which keeps every event it receives.
+	"""
+	def __init__(self):
+		self.events = []
+
+	def __call__(self, event):
+		self.events.append(event)
+
+	def select(self, event = None, engine = None):
+		"""
+		Returns the events recorded of a specified kind and/or from a specified routine.
+		"""
+		return [e for e in self.events if (event is None or e["event"] == event) and \
+										(engine is None or e["engine"] == engine)]
+
+	def timings(self):
+		"""
+		Returns the total time spent in each stage of each routine as a dictionary mapping
+		(engine, stage) to seconds.
+		"""
+		totals = {}
+		for e in self.select("stage"):
+			key = (e["engine"], e["stage"])
+			totals[key] = totals.get(key, 0.0) + e["elapsed"]
+		return totals
@@ -1,10 +1,13 @@
 import time
 import math
+import multiprocessing
 import constants
-import utils, primeSieve
-import pollardRho, pollardPm1, ecm
+import events
+import utils, primeSieve, primeTable, productTree, factorCache
+import pollardRho, pollardPm1, ecm, smallFactor, siqs
 
-small_primes = primeSieve.prime_sieve(constants.PRIME_THRESHOLD_BF)
+small_primes = primeSieve.to_list(primeSieve.prime_sieve(constants.PRIME_THRESHOLD_BF))
+small_primes_tree = productTree.product_tree(small_primes)
 
 def merge_factorizations(f1, f2):
 	"""
@@ -37,24 +40,67 @@ def merge_factorizations(f1, f2):
 
 def factorize_bf(n):
 	"""
-	Brute-forces small primes up to some pre-specified limit. 
+	Finds the prime factors of a specified integer below PRIME_THRESHOLD_BF. Rather than 
+	dividing by every small prime, the GCD of the integer and the product of the small 
+	primes is taken first and only the blocks of primes (nodes of their product tree) 
+	which share a factor with the integer are searched further -- so an integer without
+	small prime factors costs a single GCD. The cofactor is prime (and moved over to the
+	factorization) if it's too small to be a product of primes above the threshold.
+
+	Returns:
+		a tuple with the factorization found and the cofactor left
+
+	Examples:
+		>>> factorize_bf(2**3 * 7 * 1000003)
+		>>> ([(2, 3), (7, 1), (1000003, 1)], 1)
 	"""
-	sn = int(math.sqrt(n))
 	f = []
-	for p in small_primes:
-		if p > sn:
-			if n > 1:
-				f.append((n, 1))
-				n = 1
-			break
+	for p in productTree.divisors_in_tree(n, small_primes_tree):
 		i = 0
 		while n % p == 0:
 			n //= p
 			i += 1
-		if i > 0:
-			f.append((p, i))
- 			sn = int(math.sqrt(n))
-	
+		f.append((p, i))
+	if 1 < n < constants.PRIME_THRESHOLD_BF**2:
+		f.append((n, 1))
+		n = 1
+	return f, n
+
+
+def factorize_bf_batch(numbers):
+	"""
+	Finds the small prime factors (the ones factorize_bf looks for) of a bunch of integers
+	at once with a remainder tree over the integers and a product tree of the small primes,
+	which takes a few large multiplications instead of a division by every small prime 
+	for every integer.
+
+	Returns:
+		a list with a (factorization, cofactor) tuple for each integer, where the cofactor
+		is what's left after dividing out the small primes (unlike factorize_bf, it's left
+		as is even if it's prime)
+
+	Examples:
+		>>> factorize_bf_batch([56, 10**20 + 39])
+		>>> [([(2, 3), (7, 1)], 1), ([], 100000000000000000039L)]
+	"""
+	return productTree.trial_divide(numbers, small_primes_tree)
+
+
+def divide_known(n, cache):
+	"""
+	Divides out the primes a factorization cache already knows from a specified integer.
+
+	Returns:
+		a tuple with the factorization found and the cofactor left
+	"""
+	f, m = [], n
+	for p in cache.known_factors(n):
+		i = 0
+		while n % p == 0:
+			n //= p
+			i += 1
+		f.append((p, i))
+		events.emit("factor", "cache", n = m, factor = p)
 	return f, n
 
 
@@ -65,10 +111,115 @@ def print_factoring_routine(n, routine_name):
 	print "Factoring", str(n), "with", routine_name + "..."
 
 
-# TODO: Incorporate Pollard (p-1) into this - ignoring it for now
-def factorize(n, verbose = False, level = 3):
+# Factoring routines by name, along with their names for displaying purposes
+ENGINES = {
+	"rho": (pollardRho.factorize_rho, constants.NAME_RHO),
+	"pm1": (pollardPm1.factorize_pm1, constants.NAME_PM1),
+	"ecm": (ecm.factorize_ecm, constants.NAME_ECM),
+	"small": (smallFactor.factorize_small, constants.NAME_SMALL),
+	"siqs": (siqs.factorize_siqs, constants.NAME_SIQS)
+}
+
+
+def schedule(n, level = 2):
 	"""
-	Factorizes a specified integer or returns -1 if no factors can be found.
+	Returns the sequence of attempts at splitting a specified composite (with no small 
+	prime factors) as a list of (routine, options) tuples, in order of increasing cost. 
+
+	Numbers below SIZE_THRESHOLD_SMALL go to SQUFOF (after a few steps of Fermat's method 
+	and Hart's algorithm), which works on numbers around the square root of 'n' and beats
+	Pollard rho at that size (which is still tried if SQUFOF fails). Numbers up to 
+	SIZE_THRESHOLD_RHO go to Pollard rho, which is the cheapest method there. Larger ones
+	only get a short rho walk (for factors just above the trial division limit) and then
+	ECM with escalating bounds: a bounded number of curves at each level of ECM_SCHEDULE
+	below the bounds meant for the size of 'n' (so small factors are found at a fraction
+	of the cost of a full-size curve) followed by as many curves as it takes at those
+	bounds. Before each ECM level Pollard p-1 gets one go with bounds PM1_SCHEDULE_FACTOR
+	times larger, which costs about as much as a couple of curves and finds factors p where
+	p - 1 is smooth. Composites with SIQS_MIN_DIGITS to SIQS_MAX_DIGITS digits only get a
+	short ECM pass (the levels meant for factors of up to SIQS_ECM_FRACTION of their
+	digits) before the quadratic sieve, whose running time only depends on the size of 'n',
+	with the full-size curves kept as a fallback.
+
+	Arguments:
+		n (:int) - the composite to be split
+		level (:int) - SQUFOF and Pollard rho are only used if this is at least 2 and p-1 
+		               and ECM if it's at least 1
+
+	Examples:
+		>>> schedule(10**20 - 1)
+		>>> [('rho', {}), ('ecm', {'bounds': (2000, 147396)})]
+	"""
+	steps = []
+	if level > 1:
+		if n < constants.SIZE_THRESHOLD_SMALL:
+			steps.append(("small", {}))
+		if n <= constants.SIZE_THRESHOLD_RHO:
+			steps.append(("rho", {}))
+		else:
+			steps.append(("rho", {"max_iterations": constants.RHO_SHORT_ITERATIONS}))
+	if level < 1:
+		return steps
+	final = ecm.compute_bounds(n)
+	if steps and n <= constants.SIZE_THRESHOLD_RHO:
+		# ECM is only a fallback in case rho fails
+		return steps + [("ecm", {"bounds": final})]
+
+	digits = len(str(n))
+	use_siqs = constants.SIQS_MIN_DIGITS <= digits <= constants.SIQS_MAX_DIGITS
+	pm1_B1 = 0
+	for i, (B1, B2, curves) in enumerate(constants.ECM_SCHEDULE):
+		if B1 >= final[0]:
+			break
+		# The i-th level is meant for factors of about 15 + 5i digits
+		if use_siqs and i > 0 and 15 + 5*i > digits * constants.SIQS_ECM_FRACTION:
+			break
+		b = min(constants.PM1_SCHEDULE_FACTOR * B1, constants.MAX_B1_PM1)
+		if b > pm1_B1:
+			steps.append(("pm1", {"bounds": (b, min(constants.PM1_SCHEDULE_B2_RATIO * b, constants.MAX_B2_PM1))}))
+			pm1_B1 = b
+		steps.append(("ecm", {"bounds": (B1, B2), "max_curves": curves}))
+	if use_siqs:
+		steps.append(("siqs", {}))
+	b = min(constants.PM1_SCHEDULE_FACTOR * final[0], constants.MAX_B1_PM1)
+	if b > pm1_B1:
+		steps.append(("pm1", {"bounds": (b, min(constants.PM1_SCHEDULE_B2_RATIO * b, constants.MAX_B2_PM1))}))
+	steps.append(("ecm", {"bounds": final}))
+	return steps
+
+
+def find_factor(n, verbose = False, deadline = None, level = 2):
+	"""
+	Runs the attempts in the schedule for a specified composite until one of them finds a
+	non-trivial factor (or the deadline passes).
+
+	Returns:
+		a tuple with the factor found (-1 if none) and the name of the routine which 
+		found it
+	"""
+	for engine, options in schedule(n, level):
+		if utils.expired(deadline):
+			break
+		routine, name = ENGINES[engine]
+		if verbose:
+			print_factoring_routine(n, name)
+		g = routine(n, verbose = verbose, deadline = deadline, **options)
+		if g != -1:
+			if verbose:
+				print "Found factor", str(g)
+			events.emit("factor", engine, n = n, factor = g)
+			return g, engine
+	return -1, None
+
+
+def factorize(n, verbose = False, level = 3, deadline = None):
+	"""
+	Factorizes a specified integer or returns -1 if no factors can be found (before the 
+	'deadline', a time as returned by time.time(), if one is specified). Small prime 
+	factors are found by trial division (if 'level' is 3) and the rest by the factoring
+	routines in the order given by schedule(). At level 3 factorizations are looked up in
+	(and added to) the factorization cache, and primes found in earlier factorizations 
+	are divided out before any factoring routine runs (see factorCache.py).
 	"""
 	if verbose: 
 		if n != 1: 
@@ -79,51 +230,314 @@ def factorize(n, verbose = False, level = 3):
 	if utils.is_prime(n):
 		if verbose:
 			print str(n), "is prime!"
+		events.emit("prime", "factorize", n = n)
 		return [(n, 1)]
-	else:
-		f, f1 = [], []
-		if level > 2:
-			# Try brute force for small prime factors
-			if verbose: 
-				print "Finding small prime factors..."
-			f, n = factorize_bf(n)
-			if verbose:
-				if not f:
-					print "Found no small prime factors... :("
-				else:
-					print "Prime factors found:", reduce(lambda x, y: x + y, [str(i[0]) + ", " for i in f])[:-2]
 
-		
-		if level > 1 and n <= constants.SIZE_THRESHOLD_RHO and n > 1:
-			# Try Pollard rho
-			if verbose:
-				print_factoring_routine(n, constants.NAME_RHO)
-			
-			g = pollardRho.factorize_rho(n, verbose = verbose)
-			if g != -1:
+	if level > 2:
+		cache = factorCache.default_cache()
+		if cache is not None:
+			f = cache.get(n)
+			if f is not None:
 				if verbose:
-					print "Found factor", str(g)
-				f1 = merge_factorizations(factorize(g, verbose = verbose, level = 2), \
-								factorize(n/g, verbose = verbose, level = 2))
-				if f1 != -1:
-					f.extend(f1)
-		
-		if level > 0 and (f1 == -1 or n > constants.SIZE_THRESHOLD_RHO) and n > 1:
-			# If Pollard rho fails try ECM
-			if verbose:
-				print_factoring_routine(n, constants.NAME_ECM)
+					print "Found cached factorization!"
+				return list(f)
 
-			g = ecm.factorize_ecm(n, verbose = verbose)
-			if g != -1:
-				if verbose:
-					print "Found factor", str(g)
-				f1 = merge_factorizations(factorize(g, verbose = verbose, level = 2), \
-								factorize(n/g, verbose = verbose, level = 2))
-				if f1 != -1:
-					f.extend(f1)
-				else:
-					f = -1
-		return f
+		# Try brute force for small prime factors
+		if verbose: 
+			print "Finding small prime factors..."
+		t, m = time.time(), n
+		f, n = factorize_bf(n)
+		events.emit("stage", "bf", n = m, stage = 1, elapsed = time.time() - t, \
+					found = [p for p, _ in f] or None)
+		for p, _ in f:
+			events.emit("factor", "bf", n = m, factor = p)
+		if verbose:
+			if not f:
+				print "Found no small prime factors... :("
+			else:
+				print "Prime factors found:", reduce(lambda x, y: x + y, [str(i[0]) + ", " for i in f])[:-2]
+		if cache is None:
+			return merge_factorizations(f, factorize(n, verbose, 2, deadline))
+
+		known, n = divide_known(n, cache)
+		if verbose and known:
+			print "Known prime factors found:", ", ".join([str(p) for p, _ in known])
+		result = merge_factorizations(merge_factorizations(f, known), \
+										factorize(n, verbose, 2, deadline))
+		cache.put(m, result)
+		return result
+
+	g, _ = find_factor(n, verbose, deadline, level)
+	if g == -1:
+		return -1
+	return merge_factorizations(factorize(g, verbose, 2, deadline), \
+								factorize(n/g, verbose, 2, deadline))
+
+
+class PartialFactorization(object):
+	"""
+	The (possibly incomplete) factorization of an integer, i.e. its prime factors found so 
+	far along with the composite cofactors which are yet to be factored. Both are lists of
+	(factor, exponent) tuples sorted in increasing order of the factors, and the product 
+	of all of them is always the integer itself.
+	"""
+	def __init__(self, n, primes, composites):
+		self.n = n
+		self.primes = primes
+		self.composites = composites
+
+	@property
+	def complete(self):
+		"""
+		True if every factor is prime.
+		"""
+		return not self.composites
+
+	def __repr__(self):
+		return "PartialFactorization(%d, primes = %r, composites = %r)" % (self.n, \
+					self.primes, self.composites)
+
+
+def _collect(factors):
+	"""
+	Turns a dictionary mapping factors to exponents into a sorted list of tuples.
+	"""
+	return sorted(factors.items())
+
+
+def factorize_partial(n, budget = None, deadline = None, verbose = False):
+	"""
+	Factorizes a specified integer as far as possible within a time budget. Whatever the 
+	factoring routines couldn't split in time (or at all) is returned as composite 
+	cofactors rather than discarding the prime factors already found.
+
+	Arguments:
+		n (:int) - the integer to be factorized
+		budget (:float) - the time (in seconds) allowed for factoring
+		deadline (:float) - the time (as returned by time.time()) by which to stop 
+		                    factoring; overrides 'budget' if both are specified
+		verbose (:bool) - flag to print progress
+
+	Returns:
+		a PartialFactorization of 'n'
+
+	Examples:
+		>>> factorize_partial(2**10 * 1000003 * (10**30 + 57) * (10**30 + 61), budget = 0.2)
+		>>> PartialFactorization(1024...344, primes = [(2, 10), (31, 1), (229, 1), (279949, 1),
+		                         (1000003, 1), (1694831, 1)], composites = [(2968...717, 1)])
+	"""
+	if deadline is None and budget is not None:
+		deadline = time.time() + budget
+	primes, composites = {}, {}
+	if n == 1:
+		return PartialFactorization(n, [], [])
+
+	cache = factorCache.default_cache()
+	f = cache.get(n) if cache is not None else None
+	if f is not None:
+		return PartialFactorization(n, list(f), [])
+
+	f, m = factorize_bf(n)
+	if cache is not None:
+		known, m = divide_known(m, cache)
+		f += known
+	for p, e in f:
+		primes[p] = primes.get(p, 0) + e
+	stack = [m] if m > 1 else []
+	while stack:
+		c = stack.pop()
+		if utils.is_prime(c):
+			primes[c] = primes.get(c, 0) + 1
+			continue
+
+		g, _ = find_factor(c, verbose, deadline)
+		if g == -1:
+			composites[c] = composites.get(c, 0) + 1
+		else:
+			stack.extend([g, c // g])
+
+	if cache is not None:
+		if composites:
+			cache.add_primes(primes.keys())
+		else:
+			cache.put(n, _collect(primes))
+	return PartialFactorization(n, _collect(primes), _collect(composites))
+
+
+def _warm_up():
+	"""
+	Does the precomputation shared by all factorizations in a process ahead of time, i.e. 
+	maps the prime table (the small primes are computed when the module is imported).
+	"""
+	if constants.USE_PRIME_TABLE:
+		try:
+			primeTable.get_table(constants.PRIME_TABLE_MIN_LIMIT)
+		except EnvironmentError:
+			pass
+
+
+def _trial_divided(numbers, cache = None):
+	"""
+	Yields (n, small prime factors of n, cofactor) tuples for a bunch of integers, trial 
+	dividing them BATCH_TRIAL_SIZE at a time with factorize_bf_batch. Primes known to the
+	cache are divided out as well, and integers whose factorization is cached come out 
+	fully factored (with a cofactor of 1).
+	"""
+	def finish(chunk):
+		for n, (f, m) in zip(chunk, factorize_bf_batch(chunk)):
+			if cache is not None and m > 1:
+				known, m = divide_known(m, cache)
+				f = merge_factorizations(f, known)
+			yield n, f, m
+
+	chunk = []
+	for n in numbers:
+		f = cache.get(n) if cache is not None else None
+		if f is not None:
+			# Keep the order of the input
+			for item in finish(chunk):
+				yield item
+			chunk = []
+			yield n, list(f), 1
+			continue
+		chunk.append(n)
+		if len(chunk) == constants.BATCH_TRIAL_SIZE:
+			for item in finish(chunk):
+				yield item
+			chunk = []
+	for item in finish(chunk):
+		yield item
+
+
+def split_shared(numbers):
+	"""
+	Splits a bunch of integers using the factors they share with each other (see the batch
+	GCD in productTree.py), which takes quasi-linear time in the total size of the integers
+	when only a few of them share factors.
+
+	Returns:
+		a list with a list of (piece, exponent) tuples for each integer, whose product is
+		the integer, where the pieces are pairwise coprime (but not necessarily prime)
+
+	Examples:
+		>>> split_shared([1000003 * 1000033, 1000003 * 1000037, 1000039 * 1000081])
+		>>> [[(1000003, 1), (1000033, 1)], [(1000003, 1), (1000037, 1)], [(1000120003159, 1)]]
+	"""
+	distinct = sorted(set(n for n in numbers if n > 1))
+	shared = {}
+	for n, g in zip(distinct, productTree.batch_gcd(distinct)):
+		if g != 1:
+			shared[n] = g
+	if not shared:
+		return [[(n, 1)] if n > 1 else [] for n in numbers]
+
+	base = productTree.coprime_base(shared.values() + [n // g for n, g in shared.items()])
+	tree = productTree.product_tree(sorted(base))
+	pieces = {}
+	for n in shared:
+		m, pieces[n] = n, []
+		for b in productTree.divisors_in_tree(n, tree):
+			i = 0
+			while m % b == 0:
+				m //= b
+				i += 1
+			pieces[n].append((b, i))
+			# Only the pieces of the part shared with other integers were found by the batch
+			# GCD (the rest is just what's left of n)
+			if b != n and shared[n] % b == 0:
+				events.emit("factor", "batchgcd", n = n, factor = b)
+	return [pieces.get(n, [(n, 1)] if n > 1 else []) for n in numbers]
+
+
+def _split_shared(items):
+	"""
+	Splits the cofactors of (n, small prime factors of n, cofactor) tuples using the 
+	factors they share, BATCH_GCD_SIZE at a time, and yields them as (n, factors, pieces) 
+	tuples where the pieces are the (piece, exponent) tuples the cofactor splits into.
+	"""
+	if not constants.USE_BATCH_GCD:
+		for n, f, m in items:
+			yield n, f, [(m, 1)] if m > 1 else []
+		return
+
+	block = []
+	for item in items:
+		block.append(item)
+		if len(block) == constants.BATCH_GCD_SIZE:
+			for (n, f, _), pieces in zip(block, split_shared([m for _, _, m in block])):
+				yield n, f, pieces
+			block = []
+	for (n, f, _), pieces in zip(block, split_shared([m for _, _, m in block])):
+		yield n, f, pieces
+
+
+def _factorize_one(item):
+	"""
+	Finishes factorizing a single (trial divided and split) integer in a worker process 
+	and returns it along with its factorization.
+	"""
+	n, f, pieces = item
+	for m, e in pieces:
+		g = factorize(m, level = 2)
+		if g == -1:
+			return n, -1
+		f = merge_factorizations(f, [(p, i * e) for p, i in g])
+	return n, f
+
+
+def factorize_many(numbers, workers = None, ordered = True):
+	"""
+	Factorizes a bunch of integers in parallel over a pool of worker processes. Each worker
+	does the precomputation (small primes, prime table) once and reuses it for every number
+	it's handed. The small prime factors of all the numbers are stripped in batches (see
+	factorize_bf_batch) before they're handed out, and numbers in the factorization cache
+	aren't factored again. Numbers which share factors with others in the batch are split 
+	(see split_shared) before any factoring routine runs on them. Results are streamed 
+	back as they're found.
+
+	Arguments:
+		numbers (:int iterable) - the integers to be factorized
+		workers (:int) - the number of worker processes (defaults to the number of CPUs)
+		ordered (:bool) - flag to indicate whether results are yielded in the order of the
+		                  input or as soon as they finish
+
+	Returns:
+		a generator of (n, factorization of n) tuples where the factorization is -1 if 'n' 
+		couldn't be factored
+
+	Examples:
+		>>> list(factorize_many([15, 56], workers = 2))
+		>>> [(15, [(3, 1), (5, 1)]), (56, [(2, 3), (7, 1)])]
+	"""
+	if workers is None:
+		workers = multiprocessing.cpu_count()
+
+	# Build the prime table before forking so that the workers don't race to build it
+	_warm_up()
+	cache = factorCache.default_cache()
+	items = _split_shared(_trial_divided(numbers, cache))
+	if workers <= 1:
+		for item in items:
+			n, f = _factorize_one(item)
+			if cache is not None:
+				cache.put(n, f)
+			yield n, f
+		return
+
+	pool = multiprocessing.Pool(workers, initializer = _warm_up)
+	try:
+		if ordered:
+			results = pool.imap(_factorize_one, items, constants.BATCH_CHUNK_SIZE)
+		else:
+			results = pool.imap_unordered(_factorize_one, items, constants.BATCH_CHUNK_SIZE)
+		for n, f in results:
+			if cache is not None:
+				cache.put(n, f)
+			yield n, f
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
 
 
 def print_factorization(n, f):
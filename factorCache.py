@@ -0,0 +1,184 @@
+# coding=utf-8
+
+"""
+This module contains a persistent cache of factorizations which lets repeated inputs be
+answered without any factoring at all. Factorizations are kept in an in-memory LRU cache
+backed by an on-disk key-value store (whichever dbm module is available, in ~/.factor by
+default), so they survive across runs. The store keeps the last FACTOR_CACHE_DISK_SIZE
+factorizations; the oldest ones are dropped first.
+
+-> KNOWN PRIMES
+Every prime (above the trial division limit) in a cached factorization is recorded as
+well. New inputs often share primes with earlier ones, so before any factoring routine
+is run the GCD of the input and the product of all the known primes is taken and the
+primes dividing it are picked out of a product tree of the known primes (as in batch
+trial division, see productTree.py). Only the FACTOR_CACHE_PRIMES most recently used
+primes are kept, so the product stays small, and they're stored under a single key so
+opening the store doesn't mean walking through all of it.
+
+Examples:
+	>>> cache = FactorCache("/tmp/factors.db")
+	>>> cache.put(10**20 + 39, [(10**20 + 39, 1)])
+	>>> cache.known_factors((10**20 + 39)**2 * 7)
+	>>> [100000000000000000039L]
+"""
+
+import os
+import json
+import atexit
+import anydbm
+import threading
+import utils
+import productTree
+import constants
+
+# Prefixes of the keys of factorizations and of their positions in the order they were
+# stored in, and the keys of the known primes and of the first and next positions
+FACTOR_KEY = "n:"
+ORDER_KEY = "i:"
+PRIMES_KEY = "primes"
+BOUNDS_KEY = "bounds"
+
+# Shared cache (None if it hasn't been opened yet)
+_default = None
+
+
+class FactorCache(object):
+	"""
+	A cache of factorizations (and of the primes they contain) keyed by the integer
+	factored. The store on disk is optional; without a path only the in-memory LRU cache
+	and the known primes of this process are used. The cache can be shared between threads
+	(factorize_many looks inputs up in the thread of its process pool which hands out the
+	work while the results are cached in the main thread).
+	"""
+	def __init__(self, path = None, max_entries = constants.FACTOR_CACHE_SIZE, \
+					max_stored = constants.FACTOR_CACHE_DISK_SIZE, \
+					max_primes = constants.FACTOR_CACHE_PRIMES):
+		self.path = path
+		self.max_stored = max_stored
+		self._memory = utils.LRUCache(max_entries)
+		self._store = None
+		self._primes = utils.LRUCache(max_primes)
+		self._tree = None
+		self._dirty = False
+		self._first = self._next = 0
+		self._lock = threading.RLock()
+		if path is not None:
+			self._store = anydbm.open(path, "c")
+			if BOUNDS_KEY in self._store:
+				self._first, self._next = json.loads(self._store[BOUNDS_KEY])
+			if PRIMES_KEY in self._store:
+				for p in json.loads(self._store[PRIMES_KEY]):
+					self._primes.put(int(p), None)
+
+	def close(self):
+		"""
+		Closes the store on disk (if there is one).
+		"""
+		with self._lock:
+			if self._store is not None:
+				if self._dirty:
+					self._store[PRIMES_KEY] = json.dumps([str(p) for p in self._primes.keys()])
+				self._store.close()
+				self._store = None
+
+	def __len__(self):
+		return len(self._memory)
+
+	def get(self, n):
+		"""
+		Returns the cached factorization of a specified integer or None if it isn't cached.
+		"""
+		with self._lock:
+			f = self._memory.get(n)
+			if f is not None or self._store is None:
+				return f
+			key = FACTOR_KEY + str(n)
+			if key not in self._store:
+				return None
+			f = [(int(p), e) for p, e in json.loads(self._store[key])]
+			self._memory.put(n, f)
+			return f
+
+	def put(self, n, f):
+		"""
+		Caches the factorization of a specified integer and records its primes.
+		"""
+		with self._lock:
+			if f == -1:
+				return
+			# Keep a copy so that callers can't change the cached factorization
+			self._memory.put(n, list(f))
+			if self._store is not None:
+				key = FACTOR_KEY + str(n)
+				if key not in self._store:
+					self._store[ORDER_KEY + str(self._next)] = str(n)
+					self._next += 1
+					# Drop the oldest factorizations once there are too many
+					while self._next - self._first > self.max_stored:
+						order = ORDER_KEY + str(self._first)
+						del self._store[FACTOR_KEY + self._store[order]]
+						del self._store[order]
+						self._first += 1
+					self._store[BOUNDS_KEY] = json.dumps([self._first, self._next])
+				self._store[key] = json.dumps([(str(p), e) for p, e in f])
+			self.add_primes([p for p, _ in f])
+
+	def add_primes(self, primes):
+		"""
+		Records primes as known so that later inputs are checked against them. Primes below
+		the trial division limit are left out since trial division finds them anyway. The
+		known primes are written to the store when it's closed.
+		"""
+		with self._lock:
+			for p in primes:
+				if p >= constants.PRIME_THRESHOLD_BF and p not in self._primes:
+					self._primes.put(p, None)
+					self._tree = None
+					self._dirty = True
+
+	def known_primes(self):
+		"""
+		Returns the number of primes recorded.
+		"""
+		return len(self._primes)
+
+	def known_factors(self, n):
+		"""
+		Returns the known primes which divide a specified integer, in increasing order.
+		"""
+		with self._lock:
+			if not self._primes:
+				return []
+			tree = self._tree
+			if tree is None:
+				tree = self._tree = productTree.product_tree(sorted(self._primes.keys()))
+			g = utils.gcd(tree[-1][0] % n, n)
+			if g == 1:
+				return []
+			factors = productTree.divisors_in_tree(g, tree)
+			for p in factors:
+				# Primes which keep turning up are the last to be dropped
+				self._primes.get(p)
+			return factors
+
+
+def default_cache():
+	"""
+	Returns the cache shared by the factoring routines, or None if it's disabled (set
+	USE_FACTOR_CACHE in constants.py to False). The cache is kept in memory only if the
+	store on disk can't be opened.
+	"""
+	global _default
+	if not constants.USE_FACTOR_CACHE:
+		return None
+	if _default is None:
+		path = os.path.join(constants.PRIME_TABLE_DIR, constants.FACTOR_CACHE_NAME)
+		try:
+			if not os.path.isdir(constants.PRIME_TABLE_DIR):
+				os.makedirs(constants.PRIME_TABLE_DIR)
+			_default = FactorCache(path)
+		except (EnvironmentError, anydbm.error):
+			_default = FactorCache()
+		atexit.register(_default.close)
+	return _default
@@ -1,8 +1,10 @@
 # coding=utf-8
 
 import math
+import time
 import utils
-import primeSieve
+import events
+import primeTable
 import constants
 
 """
@@ -30,37 +32,98 @@ def compute_bounds(n):
 	return B1, B2
 
 
-def factorize_pm1(n, verbose = False):
+def stage2(c, n, B1, B2, deadline = None):
+	"""
+	Stage 2 of the algorithm, where 'c' is the result of stage 1. Returns the last GCD
+	computed (a non-trivial factor if one was found) and the number of GCDs computed. Gives
+	up (returning 1) once the deadline passes.
+	"""
+	d_cache = [-1] * (constants.MAX_D_PM1 + 1)
+	p, temp_c, count, gcds = -1, c, 0, 0
+
+	# Stream the primes in (B1, B2] segment by segment
+	for segment in primeTable.prime_segments(B1+1, B2):
+		for q in segment:
+			if p == -1:
+				c, p = pow(c, q, n), q
+				continue
+
+			# Use differences between successive primes and cache them
+			d = q - p
+			if d <= constants.MAX_D_PM1:
+				if d_cache[d] == -1:
+					x = pow(temp_c, d, n)
+					d_cache[d] = x
+				else:
+					x = d_cache[d]
+			else:
+				x = pow(temp_c, d, n)
+
+			# Use modular multiplication instead of exponentiation to speed things up
+			c, p = (c * x) % n, q
+			count += 1
+
+			# Accumulate products and compute GCD's periodically 
+			if (count & 127) == 0:
+				g = utils.gcd(c - 1, n)
+				gcds += 1
+				# Return non-trivial factor if successful
+				if g != 1 and g != n:
+					return g, gcds
+				if utils.expired(deadline):
+					return 1, gcds
+
+	return utils.gcd(c-1, n), gcds + 1
+
+
+def factorize_pm1(n, verbose = False, deadline = None, bounds = None):
+	"""
+	Returns a non-trivial factor of 'n' found with the two stage p-1 algorithm or -1 if 
+	none is found (before the 'deadline', a time as returned by time.time(), if one is 
+	specified). The stage 1 and stage 2 bounds can be specified as a tuple (B1, B2) 
+	instead of being derived from the size of 'n'.
+	"""
 	if n == 1 or utils.is_prime(n):
 		return n
 	elif n % 2 == 0:
 		return 2
 
-	B1, B2 = compute_bounds(n)
+	B1, B2 = bounds or compute_bounds(n)
 	if verbose: 
 		print "Number of digits:", len(str(n))
 		print "Bounds:", B1, B2
+	t = time.time()
+	events.emit("start", "pm1", n = n)
+	events.emit("bounds", "pm1", n = n, B1 = B1, B2 = B2)
 
 	# ----- Stage 1 -----
 	if verbose: 
 		print "Stage 1..."
 		print "Sieveing primes below", str(B1)
 
-	primes_below_b1 = primeSieve.prime_sieve(B1)
+	primes_below_b1 = primeTable.prime_range(2, B1)
 
 	# Compute a large number which is B1-power-smooth. As in this implementation,
 	# a usual choice for this number is the LCM of the integers below B1. 
-	c = 2
+	c, count = 2, 0
 	for p in primes_below_b1:
 		pp = p
 		while pp <= B1:
 			c = pow(c, p, n)
 			pp *= p
+		count += 1
+		if (count & 1023) == 0 and utils.expired(deadline):
+			break
 
 	g = utils.gcd(c-1, n)
+	found = g if g != 1 and g != n else None
+	t2 = time.time()
+	events.emit("stage", "pm1", n = n, stage = 1, elapsed = t2 - t, found = found)
 	# If stage 1 is successful, return the non-trivial factor found. Else, go on
 	# to stage 2. 
-	if g != 1 and g != n:
+	if found or utils.expired(deadline):
+		g = found or -1
+		events.emit("end", "pm1", n = n, factor = g, elapsed = t2 - t, gcds = 1)
 		return g
 
 	# ----- Stage 2 -----
@@ -70,37 +133,12 @@ def factorize_pm1(n, verbose = False):
 		print "Stage 2..."
 		print "Sieveing primes between", str(B1), "and", str(B2) 
 
-	primes = primeSieve.segmented_sieve(B1+1, B2)
-	d_cache = [-1] * (constants.MAX_D_PM1 + 1)
-	p, temp_c = primes[0], c
-	c, count = pow(c, p, n), 0
-
-	for pos in xrange(1, len(primes)):
-		q = primes[pos]
-		# Use differences between successive primes and cache them
-		d = q - p
-		if d <= constants.MAX_D_PM1:
-			if d_cache[d] == -1:
-				x = pow(temp_c, d, n)
-				d_cache[d] = x
-			else:
-				x = d_cache[d]
-		else:
-			x = pow(temp_c, d, n)
-
-		# Use modular multiplication instead of exponentiation to speed things up
-		c, p = (c * x) % n, q
-		count += 1
-
-		# Accumulate products and compute GCD's periodically 
-		if (count & 127) == 0:
-			g = utils.gcd(c - 1, n)
-			# Return non-trivial factor if successful
-			if g != 1 and g != n:
-				return g
-
-	g = utils.gcd(c-1, n)
-	if g != 1 and g != n:
-		return g
-	else:
-		return -1
+	g, gcds = stage2(c, n, B1, B2, deadline)
+	gcds += 1
+	if g == 1 or g == n:
+		g = -1
+	t3 = time.time()
+	events.emit("stage", "pm1", n = n, stage = 2, elapsed = t3 - t2, \
+				found = g if g != -1 else None)
+	events.emit("end", "pm1", n = n, factor = g, elapsed = t3 - t, gcds = gcds)
+	return g
@@ -1,5 +1,8 @@
+import time
 import utils
 import random
+import events
+import multiprocessing
 import primeSieve
 import constants
 
@@ -10,46 +13,155 @@ alogrithm.
 TODO: Include explanation of algorithm. 
 """
 
-small_primes = primeSieve.prime_sieve(constants.PRIME_THRESHOLD_RHO)
+small_primes = primeSieve.to_list(primeSieve.prime_sieve(constants.PRIME_THRESHOLD_RHO))
 
-def factorize_rho(n, verbose = False):
+def brent_walk(n, c, y, m, deadline = None, max_iterations = None, stop = None):
+    """
+    Runs a single walk of Brent's variant of the rho algorithm with the map x -> x^2 + c
+    starting from 'y' and taking GCDs every 'm' steps (at most). The walk is cut short once 
+    the deadline passes, it has taken (roughly) 'max_iterations' steps or the 'stop' event
+    is set.
+
+    Returns:
+        a tuple with the GCD found ('n' if the walk collapsed and -1 if it was cut short),
+        the number of GCDs computed and the number of steps taken
+    """
+    r, g, q, ys, x = 1, 1, 1, y, y
+    gcds, iterations = 0, 0
+    while g == 1:
+        x, k = y, 0
+        for j in range(r):
+            y = y*y + c
+            if y > n: y %= n
+        while k < r and g == 1:
+            ys, min_val = y, min(m, r-k)
+            for j in range(min_val):
+                y = y*y + c
+                if y > n : y %= n
+                q = q * abs(x - y)
+                if q > n: q %= n
+            g = utils.gcd(q, n)
+            gcds += 1
+            k += m
+            iterations += min_val
+            if g == 1 and (utils.expired(deadline) or \
+                    (max_iterations is not None and iterations >= max_iterations) or \
+                    (stop is not None and stop.is_set())):
+                return -1, gcds, iterations
+        r <<= 1
+
+    if g == n:
+        # The product of the differences in the last block was a multiple of 'n', so 
+        # backtrack through the block one step at a time
+        while True:
+            ys = ys*ys + c
+            if ys > n: ys %= n
+            g = utils.gcd(abs(x-ys), n)
+            gcds += 1
+            if g > 1:
+                break
+    return g, gcds, iterations
+
+
+def factorize_rho(n, verbose = False, deadline = None, max_iterations = None, workers = 1):
+    """
+    Returns a non-trivial factor of 'n' found with Brent's variant of the rho algorithm or
+    -1 if none is found (before the 'deadline', a time as returned by time.time(), if one is
+    specified). The walk can also be capped at (roughly) 'max_iterations' steps so that 
+    it only gets a short shot at finding a small factor. Walks which collapse (i.e. find
+    'n' itself) are retried with the next offset. Optionally races walks on several 
+    processes at once ('workers' = None uses every CPU).
+    """
     if n == 1 or utils.is_prime(n):
         return n
 
-    # If no factor is found, return -1
+    t = time.time()
+    events.emit("start", "rho", n = n)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers > 1:
+        g, walks = factorize_rho_parallel(n, workers, verbose, deadline, max_iterations)
+        events.emit("end", "rho", n = n, factor = g, elapsed = time.time() - t, \
+                    offsets = walks, workers = workers)
+        return g
+
+    gcds, iterations, offsets, g = 0, 0, 0, -1
     for i in range(len(small_primes) - 1, -1, -1):
-        r, c, y = 1, small_primes[i], random.randint(1, n-1)
+        c, y, m = small_primes[i], random.randint(1, n-1), random.randint(1, n-1)
         if verbose:
             print "Trying offset:", c
 
-        m, g, q, ys = random.randint(1, n-1), 1, 1, y
-        min_val, k = 0, 0
-        while g == 1:
-            x, k = y, 0
-            for j in range(r):
-                y = y*y + c
-                if y > n: y %= n
-            while k < r and g == 1:
-                ys, min_val = y, min(m, r-k)
-                for j in range(min_val):
-                    y = y*y + c
-                    if y > n : y %= n
-                    q = q * abs(x - y)
-                    if q > n: q %= n
-                g = utils.gcd(q, n)
-                k += m
-            r <<= 1
-        
-        if g == n:
-            # If no factor found, try again.
-            while True:
-               ys = ys*ys + c
-               if ys > n: ys %= n
-               g = utils.gcd(abs(x-ys), n)
-               if g > 1: 
-                break
-        
+        remaining = None if max_iterations is None else max_iterations - iterations
+        g, walk_gcds, walk_iterations = brent_walk(n, c, y, m, deadline, remaining)
+        gcds, iterations, offsets = gcds + walk_gcds, iterations + walk_iterations, offsets + 1
         if g != n:
-            return g
-        else:
-            return -1
+            break
+        # The walk collapsed, so try the next offset
+        g = -1
+        if utils.expired(deadline) or (max_iterations is not None and iterations >= max_iterations):
+            break
+
+    events.emit("end", "rho", n = n, factor = g, elapsed = time.time() - t, gcds = gcds, \
+                offsets = offsets)
+    return g
+
+
+def _walk_worker(n, offsets, seed, deadline, max_iterations, stop, results):
+    """
+    Runs rho walks with the specified offsets in a worker process until one of them finds
+    a factor, the offsets run out or another worker signals that it found a factor. Puts 
+    the factor found (or -1) and the number of walks run on the results queue.
+    """
+    # Listeners were inherited from the parent and would only see this process' events
+    events.clear()
+    rng = random.Random(seed)
+    walks = 0
+    for c in offsets:
+        if stop.is_set():
+            break
+        walks += 1
+        g, _, _ = brent_walk(n, c, rng.randint(1, n-1), rng.randint(1, n-1), deadline, \
+                             max_iterations, stop)
+        if g != n:
+            if g != -1:
+                results.put((g, walks))
+                return
+            break
+    results.put((-1, walks))
+
+
+def factorize_rho_parallel(n, workers, verbose = False, deadline = None, max_iterations = None):
+    """
+    Races independent rho walks (with different offsets and starting points) on several 
+    processes at once. Every worker is cancelled as soon as any of them finds a non-trivial
+    factor. Returns the factor found (or -1) along with the number of walks run.
+    """
+    stop, results = multiprocessing.Event(), multiprocessing.Queue()
+    offsets = small_primes[::-1]
+    procs = []
+    for w in xrange(workers):
+        seed = random.randint(0, constants.MAX_RND_ECM)
+        procs.append(multiprocessing.Process(target = _walk_worker, \
+                        args = (n, offsets[w::workers], seed, deadline, max_iterations, \
+                                stop, results)))
+
+    g, walks = -1, 0
+    try:
+        for proc in procs:
+            proc.daemon = True
+            proc.start()
+        for _ in xrange(workers):
+            h, w = results.get()
+            walks += w
+            if h != -1:
+                g = h
+                break
+    finally:
+        stop.set()
+        for proc in procs:
+            proc.terminate()
+            proc.join()
+
+    if verbose:
+        print "Ran", walks, "walks on", workers, "processes..."
+    return g, walks
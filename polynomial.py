@@ -0,0 +1,142 @@
+# coding=utf-8
+
+"""
+This module contains the polynomial arithmetic (over Z/nZ) needed by the FFT continuation
+of ECM stage 2. Polynomials are lists of coefficients in increasing order of degree.
+
+-> MULTIPLICATION
+Polynomials are multiplied with Kronecker substitution, i.e. by packing the coefficients
+into one large integer each (with enough room between them to avoid carries), multiplying
+these and unpacking the coefficients of the product. This way all the work is done by
+Python's (subquadratic) multiplication of large integers.
+
+-> DIVISION
+Remainders are computed with Newton iteration on the reversed divisor, so dividing costs
+a constant number of multiplications.
+
+-> PRODUCT/REMAINDER TREES
+The product of (X - a_i) over a set of points is built as a binary tree of partial
+products and a polynomial is evaluated at all of the points at once by reducing it modulo
+each node of the tree on the way down.
+
+REFERENCES:
+[1] P.L. Montgomery, R.D. Silverman; An FFT Extension to the P-1 Factoring Algorithm;
+    Mathematics of Computation, 54-190: 839-854
+[2] D.J. Bernstein; Fast multiplication and its applications; Algorithmic Number Theory,
+    MSRI Publications, 44: 325-384
+"""
+
+
+def _pack(f, k):
+	"""
+	Packs the coefficients of a polynomial into a single integer, 'k' hex digits each.
+	"""
+	if not f:
+		return 0
+	return long("".join(["%0*x" % (k, c) for c in reversed(f)]), 16)
+
+
+def _unpack(x, k, length):
+	"""
+	Unpacks 'length' coefficients of 'k' hex digits each from an integer.
+	"""
+	h = ("%x" % x).zfill(length * k)
+	end = len(h)
+	return [int(h[end - (i+1)*k : end - i*k], 16) for i in xrange(length)]
+
+
+def multiply(f, g, n):
+	"""
+	Multiplies two polynomials modulo 'n' with Kronecker substitution.
+
+	Examples:
+		>>> multiply([1, 1], [1, 1], 7)
+		>>> [1, 2, 1]
+	"""
+	if not f or not g:
+		return []
+	length = len(f) + len(g) - 1
+	# Each coefficient of the product is less than min(len(f), len(g)) * n^2
+	bits = 2 * n.bit_length() + min(len(f), len(g)).bit_length()
+	k = (bits >> 2) + 1
+	if f is g:
+		x = _pack(f, k)
+		product = x * x
+	else:
+		product = _pack(f, k) * _pack(g, k)
+	return [c % n for c in _unpack(product, k, length)]
+
+
+def inverse(f, k, n):
+	"""
+	Returns the inverse of a polynomial modulo X^k (and 'n') with Newton iteration. The
+	constant coefficient of the polynomial must be 1.
+	"""
+	g, t = [1], 1
+	while t < k:
+		t = min(t << 1, k)
+		e = multiply(f[:t], g, n)[:t]
+		e = [(-c) % n for c in e]
+		e[0] = (e[0] + 2) % n
+		g = multiply(g, e, n)[:t]
+	return g
+
+
+def remainder(a, b, n, b_inv = None):
+	"""
+	Returns the remainder of a polynomial divided by a monic polynomial 'b' modulo 'n'.
+	Optionally, one may specify the inverse of the reversal of 'b' modulo X^(len(a) - deg b)
+	if it's already known (e.g. when reducing by the same polynomial repeatedly).
+	"""
+	db = len(b) - 1
+	if len(a) <= db:
+		return a
+	dq = len(a) - 1 - db
+	if b_inv is None or len(b_inv) < dq + 1:
+		b_inv = inverse(b[::-1], dq + 1, n)
+
+	# Reversed quotient = reversed(a) / reversed(b) mod X^(dq + 1)
+	q = multiply(a[:-(dq+2):-1], b_inv[:dq + 1], n)[:dq + 1]
+	q.reverse()
+	r = multiply(q, b, n)
+	return [(a[i] - r[i]) % n for i in xrange(db)]
+
+
+def product_tree(points, n):
+	"""
+	Returns the product tree of the polynomials (X - a) for the specified points 'a' modulo
+	'n' as a list of levels. The first level has the linear factors and the last one is the
+	full product.
+	"""
+	level = [[(-a) % n, 1] for a in points]
+	tree = [level]
+	while len(level) > 1:
+		level = [multiply(level[i], level[i+1], n) if i + 1 < len(level) else level[i] \
+					for i in xrange(0, len(level), 2)]
+		tree.append(level)
+	return tree
+
+
+def from_roots(points, n):
+	"""
+	Returns the product of the polynomials (X - a) for the specified points 'a' modulo 'n'
+	without keeping the rest of the product tree around.
+	"""
+	level = [[(-a) % n, 1] for a in points]
+	if not level:
+		return [1]
+	while len(level) > 1:
+		level = [multiply(level[i], level[i+1], n) if i + 1 < len(level) else level[i] \
+					for i in xrange(0, len(level), 2)]
+	return level[0]
+
+
+def evaluate(f, tree, n):
+	"""
+	Evaluates a polynomial modulo 'n' at all the points of a product tree with a remainder
+	tree.
+	"""
+	rems = [remainder(f, tree[-1][0], n)]
+	for level in reversed(tree[:-1]):
+		rems = [remainder(rems[i >> 1], level[i], n) for i in xrange(len(level))]
+	return [r[0] if r else 0 for r in rems]
@@ -8,17 +8,23 @@ A sieve of Eratosthenes with a wheel mod 6.
 
 -> SIEVE OF ATKIN
 A segmented version of the sieve of Atkin as described in [1].
-NOTE: This would probably be a lot more efficient with NumPy arrays but PyPy doesn't  
-support NumPy as of yet. 
 
 -> SEGMENTED SIEVE OF ERATOSTHENES
-A segmented sieve of Eratosthenes with a wheel mod 2. The wheel mod 6 version of this is 
-annoying as hell to implement and might be included in the future. 
+A segmented sieve of Eratosthenes with a wheel mod 30. The numbers coprime to 30 in each 
+block of 30 are packed into the 8 bits of a byte and composites are struck off with slice
+assignments on bytearrays rather than one bit at a time.
+
+-> NUMPY BACKEND
+If NumPy is importable (and USE_NUMPY is set), all three sieves run vectorized over NumPy 
+boolean arrays instead and return the primes as an int64 array. The pure Python versions 
+are kept as a fallback (PyPy doesn't support NumPy as of yet). Use to_list() where the 
+primes have to be Python integers.
 
 
 BENCHMARKS:
 Tests performed on a Macbook Pro (mid-2012) w/ a 2.6 GHz Intel Core i7 3720QM
-processor and 8 GB RAM.
+processor and 8 GB RAM (before the wheel and NumPy versions). Run benchmark.py for
+up-to-date numbers on your own machine.
 
     BENCHMARKS |    10^6    |   10^7    |    10^8    |    10^9
     -------------------------------------------------------------
@@ -31,13 +37,26 @@ REFRENCES:
 """
 
 import math
+import array
 import time
 import utils
 import constants
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 # Sieve bits
 segs = [[] for _ in xrange(60)]
 
+# Residues coprime to 30 (one per bit) in the wheel used by the segmented sieve, the primes
+# the wheel skips, the residues set in each byte and tables which clear each bit of a byte
+WHEEL_RESIDUES = [1, 7, 11, 13, 17, 19, 23, 29]
+WHEEL_PRIMES = [2, 3, 5]
+WHEEL_BITS = [[WHEEL_RESIDUES[j] for j in xrange(8) if (b >> j) & 1] for b in xrange(256)]
+WHEEL_CLEAR = [bytes(bytearray([b & ~(1 << j) for b in xrange(256)])) for j in xrange(8)]
+
 # Primes under 60
 under60 = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59]
 
@@ -145,6 +164,8 @@ def small_sieve(n):
 		http://stackoverflow.com/questions/2068372/fastest-way-to-list-all-primes-below-n
 		/3035188#3035188
 	"""
+	if use_numpy():
+		return _small_sieve_numpy(n)
 	correction = (n % 6 > 1)
 	n = {0: n, 1: n-1, 2: n+4, 3: n+3, 4: n+2, 5: n+1}[n % 6]
 	sieve = [True] * (n/3)
@@ -256,6 +277,8 @@ def sieve_of_atkin(n):
 	Returns:
 		the primes under 'n' in a list
 	"""
+	if use_numpy():
+		return _sieve_of_atkin_numpy(n)
 	sqrt_n, u, r = int(math.sqrt(n)), n + 32, 17
 	B, lu = 60 * sqrt_n, math.log(u)
 	primes = small_sieve(sqrt_n)
@@ -299,11 +322,11 @@ def sieve_of_atkin(n):
 			for x in xrange(32):
 				k = 60 * (L + x + (j << 5))
 				for d in dAll:
-					if k + d > n:
+					if k + d >= n:
 						return ret[:r]
 					# If a_k = 1, 60k + d is a prime
 					if ((segs[d][j] << 31 - x) & 0xFFFFFFFF) >= 0x80000000:
-						ret[r] = 60*k + d
+						ret[r] = k + d
 						r += 1
 
 def prime_sieve(n):
@@ -328,17 +351,18 @@ def prime_sieve(n):
 		return under60[:utils.binary_search(n, under60)]
 	elif n <= constants.ERAT_THRESHOLD:
 		return small_sieve(n)
-	elif n <= constants.ATKIN_THERSHOLD:
-		return sieve_of_atkin(n)
 	else:
-		return segmented_sieve(2, n)
+		return segmented_sieve(2, n - 1)
 
 
-def segmented_sieve(lo, hi):
+def segmented_sieve(lo, hi, base_primes = None):
 	"""
-	Returns the primes between two specified numbers using a segmented sieve of Eratosthenes. 
-	Optionally, one may specify the size of the segment to be used. If not specified, the segment 
-	size used defaults to the square root of the difference between the two specified numbers.
+	Returns the primes between two specified numbers using a segmented sieve of Eratosthenes 
+	with a wheel mod 30. Each byte of a segment holds the 8 numbers coprime to 30 in a block
+	of 30 consecutive integers (one per bit). The multiples of a prime p ≡ r (mod 30) of a 
+	particular residue class are 30p apart, i.e. they all sit on the same bit of every p-th 
+	byte, so they're struck off in one go by translating that (extended) slice of the 
+	segment with a table which clears the bit.
 
 	NOTE: A small segment size results in low memory usage but results in a large computation time.
 	There seems to be an optimal segment size but I can't really figure out what it is.
@@ -346,61 +370,222 @@ def segmented_sieve(lo, hi):
 	Arguments:
 		lo (:int) - the lower bound of the interval
 		hi (:int) - the upper bound of the interval
+		base_primes (:int list) - the primes up to (at least) √hi if already known
 
 	Returns:
 		the primes in the interval [lo, hi] in a list
 	"""
+	if use_numpy():
+		return _segmented_sieve_numpy(lo, hi, base_primes)
 	if hi < lo: return []
-	max_prime, pos = int(math.sqrt(hi)), 0
-	base_primes = prime_sieve(max_prime)
-	primes = [0] * int(math.ceil(1.5 * hi/math.log(hi)) - math.floor(1.5 * lo/math.log(lo)))
-
-	# Include primes below √hi if necessary
-	if lo < max_prime:
-		lo_pos = utils.binary_search(lo, base_primes, include_equal = True)
-		for k in xrange(lo_pos, len(base_primes)):
-			primes[pos] = base_primes[k]
-			pos += 1
-		lo = max_prime
-
-	# Compute segment size 
+
+	# Compute segment size (in bytes, i.e. blocks of 30)
 	delta = constants.UPPER_SEG_SIZE if hi - lo >= constants.UPPER_SEG_SIZE else constants.LOWER_SEG_SIZE
 
-	l1, l = len(base_primes), (delta >> 4) + 1
-	int_size, sieve = l << 3, bytearray([0x0] * l)
-	lo_1, hi_1 = lo, lo + delta
-	
-	# Compute stuff in segments
-	while lo_1 <= hi:
-		# Re-zero sieve bits if necessary
-		if lo_1 != lo:
-			for i in range(l):
-				sieve[i] = 0
+	primes = []
+	for segment in _wheel_segments(lo, hi, delta >> 3, base_primes):
+		primes.extend(segment)
+	return primes
+
 
-		if (lo_1 & 1) == 0: 
-			lo_1 += 1
+def _wheel_segments(lo, hi, l, base_primes = None):
+	"""
+	Yields the primes in the interval [lo, hi] with the wheel (mod 30) segmented sieve in
+	lists, one for each segment of 'l' bytes (i.e. 30*l integers).
+	"""
+	lo, max_prime = max(lo, 2), int(math.sqrt(hi))
+	if base_primes is None or not len(base_primes) or base_primes[-1] < max_prime:
+		base_primes = prime_sieve(max_prime + 1)
+	else:
+		base_primes = base_primes[:utils.binary_search(max_prime, base_primes)]
+
+	small = [p for p in WHEEL_PRIMES if lo <= p <= hi]
+	if small:
+		yield small
+	start = lo - lo % 30
+
+	# Byte (relative to 'start') of the next multiple of each prime on each bit. The 
+	# multiples p*m ≡ r (mod 30) are those with m ≡ r * p^-1 (mod 30).
+	sieving_primes, nxt = [], []
+	for p in base_primes:
+		if p < 7: 
+			continue
+		inv_p, m0 = pow(p, 7, 30), max(p, (start + p - 1) // p)
+		sieving_primes.append(p)
+		for r in WHEEL_RESIDUES:
+			m = m0 + (r * inv_p - m0) % 30
+			nxt.append((p * m - start) // 30)
+
+	# Compute stuff in segments
+	seg_lo, offset = start, 0
+	while seg_lo <= hi:
+		seg_len = min(l, (hi - seg_lo) // 30 + 1)
+		sieve = bytearray(b'\xff') * seg_len
 
 		# Sieve off primes
-		for i in xrange(1, l1):
-			p = base_primes[i]
-			k = (p - (lo_1 % p)) % p
-			if (k & 1) == 1: 
-				k += p
-			k >>= 1
-			while k < int_size:
-				sieve[k >> 3] |= 1 << (k & 7)
-				k += p
-
-		# Compute primes and put them in the prime list
-		end = min(hi_1, hi) + 1
-		for n in range(lo_1, end, 2):
-			d = n - lo_1
-			if ((sieve[d >> 4] >> ((d >> 1) & 0x7)) & 0x1) == 0x0:
-				primes[pos] = n
-				pos += 1
+		t = 0
+		for p in sieving_primes:
+			for j in xrange(8):
+				k = nxt[t] - offset
+				if k < seg_len:
+					sieve[k::p] = sieve[k::p].translate(WHEEL_CLEAR[j])
+					nxt[t] += ((seg_len - 1 - k) // p + 1) * p
+				t += 1
+
+		# Compute primes
+		bits = WHEEL_BITS
+		if seg_lo < lo or seg_lo + 30*seg_len > hi:
+			yield [q for q in [seg_lo + 30*i + r for i, b in enumerate(sieve) if b \
+								for r in bits[b]] if lo <= q <= hi]
+		else:
+			yield [seg_lo + 30*i + r for i, b in enumerate(sieve) if b for r in bits[b]]
 
 		# Update segment boundaries
-		lo_1 = hi_1 + 1
-		hi_1 = lo_1 + delta
+		seg_lo += 30 * seg_len
+		offset += seg_len
+
+
+def prime_segments(lo, hi, size = constants.STREAM_SEG_SIZE):
+	"""
+	Yields the primes between two specified numbers segment by segment with the segmented 
+	sieve of Eratosthenes. Each segment is an array of the primes in an interval of length
+	at most max(size, 30), in increasing order, so the memory used is bounded by the
+	segment size rather than by the number of primes in the interval. Where the segments
+	start and end depends on the backend (the pure Python sieve works on whole blocks of 30)
+	and empty segments are skipped.
+
+	Arguments:
+		lo (:int) - the lower bound of the interval
+		hi (:int) - the upper bound of the interval
+		size (:int) - the length of the interval covered by each segment
+
+	Returns:
+		a generator of arrays of the primes in the interval [lo, hi]
 
-	return primes[:pos]
+	Examples:
+		>>> [p for s in prime_segments(2, 61, 30) for p in s]
+		>>> [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61]
+	"""
+	if hi < max(lo, 2): 
+		return
+	if use_numpy():
+		base_primes = _small_sieve_numpy(int(math.sqrt(hi)) + 1)
+		while lo <= hi:
+			seg_hi = min(lo + size - 1, hi)
+			segment = _segmented_sieve_numpy(lo, seg_hi, base_primes)
+			if len(segment):
+				yield array.array('l', segment.astype(numpy.int64).tostring())
+			lo = seg_hi + 1
+		return
+	for segment in _wheel_segments(lo, hi, max(size // 30, 1)):
+		if segment:
+			yield array.array('l', segment)
+
+
+def use_numpy():
+	"""
+	Returns True if the sieves should use the NumPy backend.
+	"""
+	return numpy is not None and constants.USE_NUMPY
+
+
+def to_list(primes):
+	"""
+	Returns the primes from any of the sieves as a list of Python integers (NumPy integers 
+	silently overflow when multiplied with large numbers).
+	"""
+	if numpy is not None and isinstance(primes, numpy.ndarray):
+		return primes.tolist()
+	return list(primes)
+
+
+def _small_sieve_numpy(n):
+	"""
+	Returns the primes under a specified number as an int64 array with a sieve of 
+	Eratosthenes on the odd numbers, vectorized with NumPy.
+	"""
+	if n <= 2:
+		return numpy.zeros(0, dtype = numpy.int64)
+	# sieve[i] corresponds to 2i + 1
+	sieve = numpy.ones(n >> 1, dtype = numpy.bool_)
+	sieve[0] = False
+	for i in xrange(3, int(math.sqrt(n)) + 1, 2):
+		if sieve[i >> 1]:
+			sieve[(i*i) >> 1::i] = False
+	primes = 2 * numpy.flatnonzero(sieve).astype(numpy.int64) + 1
+	return numpy.concatenate((numpy.array([2], dtype = numpy.int64), primes))
+
+
+def _sieve_of_atkin_numpy(n):
+	"""
+	Returns the primes under a specified number as an int64 array with the sieve of Atkin,
+	vectorized with NumPy. For a fixed x the values of each quadratic form are distinct, so 
+	a whole row of y's is toggled at once.
+	"""
+	if n <= constants.SMALL_THRESHOLD:
+		return numpy.array(under60[:utils.binary_search(n - 1, under60)], dtype = numpy.int64)
+	sieve = numpy.zeros(n, dtype = numpy.bool_)
+	y = numpy.arange(1, int(math.sqrt(n)) + 1, dtype = numpy.int64)
+	y2 = y * y
+
+	# 4x^2 + y^2 = k with k = 1, 5 (mod 12)
+	for x in xrange(1, int(math.sqrt(n / 4)) + 1):
+		k = 4*x*x + y2
+		k = k[k < n]
+		sieve[k[(k % 12 == 1) | (k % 12 == 5)]] ^= True
+
+	# 3x^2 + y^2 = k with k = 7 (mod 12)
+	for x in xrange(1, int(math.sqrt(n / 3)) + 1):
+		k = 3*x*x + y2
+		k = k[k < n]
+		sieve[k[k % 12 == 7]] ^= True
+
+	# 3x^2 - y^2 = k with x > y and k = 11 (mod 12)
+	for x in xrange(1, int(math.sqrt(n / 2)) + 2):
+		k = 3*x*x - y2[:x-1]
+		k = k[k < n]
+		sieve[k[k % 12 == 11]] ^= True
+
+	# Sieve off non-squarefree numbers
+	for r in xrange(5, int(math.sqrt(n)) + 1):
+		if sieve[r]:
+			sieve[r*r::r*r] = False
+
+	sieve[2] = sieve[3] = True
+	return numpy.flatnonzero(sieve).astype(numpy.int64)
+
+
+def _segmented_sieve_numpy(lo, hi, base_primes = None):
+	"""
+	Returns the primes between two specified numbers as an int64 array with a segmented 
+	sieve of Eratosthenes on the odd numbers, vectorized with NumPy.
+	"""
+	lo = max(lo, 2)
+	if hi < lo:
+		return numpy.zeros(0, dtype = numpy.int64)
+	max_prime = int(math.sqrt(hi))
+	if base_primes is None or not len(base_primes) or base_primes[-1] < max_prime:
+		base_primes = _small_sieve_numpy(max_prime + 1)
+	base_primes = [int(p) for p in base_primes if 2 < p <= max_prime]
+
+	segments = [numpy.array([2], dtype = numpy.int64)] if lo == 2 else []
+	seg_lo, size = lo | 1, constants.NUMPY_SEG_SIZE
+	while seg_lo <= hi:
+		# Odd numbers seg_lo, seg_lo + 2, ..., seg_hi
+		seg_hi = min(seg_lo + 2 * (size - 1), hi)
+		sieve = numpy.ones(((seg_hi - seg_lo) >> 1) + 1, dtype = numpy.bool_)
+		for p in base_primes:
+			k = p * p
+			if k > seg_hi:
+				break
+			if k < seg_lo:
+				k = seg_lo + (-seg_lo) % p
+				if not k & 1:
+					k += p
+			sieve[(k - seg_lo) >> 1::p] = False
+		if seg_lo == 1:
+			sieve[0] = False
+		segments.append(seg_lo + 2 * numpy.flatnonzero(sieve).astype(numpy.int64))
+		seg_lo = seg_hi + 2
+
+	return numpy.concatenate(segments) if segments else numpy.zeros(0, dtype = numpy.int64)
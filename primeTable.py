@@ -0,0 +1,341 @@
+# coding=utf-8
+
+"""
+This module contains a persistent table of primes which is shared by all the factoring
+routines. The table is sieved once (with the segmented sieve of Eratosthenes), written to
+disk and memory-mapped on later runs so that ECM and Pollard p-1 don't have to sieve the
+same primes over and over again.
+
+FILE FORMAT:
+The odd primes up to the limit of the table are stored as a stream of half-gaps, i.e.
+(p_{i+1} - p_i)/2, one byte each. Half-gaps that don't fit in a byte (these only occur
+above ~3*10^11) are written as a zero byte followed by the half-gap as a 32-bit integer.
+Every PRIME_TABLE_BLOCK-th prime is recorded in a block index along with the position of
+the gap following it, so that range queries only need to decode at most one block before
+reaching the primes they are after.
+
+    HEADER | GAPS | INDEX
+
+The prime 2 is not stored explicitly and is handled by the queries instead.
+"""
+
+import os
+import mmap
+import array
+import itertools
+import struct
+import primeSieve
+import constants
+
+MAGIC = "PTBL"
+VERSION = 1
+TABLE_NAME = "primes.bin"
+
+# Magic, version, limit, number of odd primes, block size, number of blocks, index offset
+HEADER = struct.Struct("<4sIQQIQQ")
+INDEX_ENTRY = struct.Struct("<QQ")
+ESCAPE = struct.Struct("<I")
+
+# Number of gap bytes decoded at a time
+DECODE_CHUNK = 65536
+
+# Tables opened so far in this process
+_tables = {}
+
+
+class PrimeTable(object):
+	"""
+	A memory-mapped, gap-encoded table of all the primes up to some limit.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self._file = open(path, "rb")
+		self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		magic, version, self.limit, self._count, self.block_size, self.num_blocks, \
+			self._index_offset = HEADER.unpack_from(self._map, 0)
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise IOError("Not a prime table: " + path)
+
+	def close(self):
+		"""
+		Unmaps the table and closes the underlying file.
+		"""
+		self._map.close()
+		self._file.close()
+
+	def __len__(self):
+		return self._count + 1
+
+	def _block(self, b):
+		"""
+		Returns the first prime in a specified block and the position of the gap
+		following it.
+		"""
+		return INDEX_ENTRY.unpack_from(self._map, self._index_offset + b * INDEX_ENTRY.size)
+
+	def _find_block(self, x):
+		"""
+		Returns the last block whose first prime doesn't exceed a specified number
+		(or 0 if there is no such block).
+		"""
+		l, r = 0, self.num_blocks - 1
+		while l < r:
+			m = (l + r + 1) >> 1
+			if self._block(m)[0] <= x:
+				l = m
+			else:
+				r = m - 1
+		return l
+
+	def _decode_chunks(self, p, pos):
+		"""
+		Yields the odd primes following 'p' in arrays (one per DECODE_CHUNK bytes of
+		gaps) where 'pos' is the position of the gap immediately after 'p'.
+		"""
+		mm, end = self._map, self._index_offset
+		while pos < end:
+			buf = bytearray(mm[pos:min(pos + DECODE_CHUNK, end)])
+			chunk = array.array('l', [0]) * len(buf)
+			i, j, l = 0, 0, len(buf)
+			while i < l:
+				h = buf[i]
+				if h:
+					i += 1
+				else:
+					h = ESCAPE.unpack_from(mm, pos + i + 1)[0]
+					i += ESCAPE.size + 1
+				p += h << 1
+				chunk[j] = p
+				j += 1
+			del chunk[j:]
+			yield chunk
+			pos += i
+
+	def _decode(self, p, pos):
+		"""
+		Yields the odd primes following 'p' one at a time.
+		"""
+		for chunk in self._decode_chunks(p, pos):
+			for q in chunk:
+				yield q
+
+	def primes(self, lo, hi):
+		"""
+		Yields the primes in the interval [lo, hi] in increasing order.
+
+		Arguments:
+			lo (:int) - the lower bound of the interval
+			hi (:int) - the upper bound of the interval (at most the limit of the table)
+
+		Examples:
+			>>> list(table.primes(10, 30))
+			>>> [11, 13, 17, 19, 23, 29]
+		"""
+		if hi > self.limit:
+			raise ValueError("Prime table only goes up to " + str(self.limit))
+		if lo <= 2 <= hi:
+			yield 2
+		if hi < 3 or self._count == 0:
+			return
+
+		p, pos = self._block(self._find_block(lo))
+		if lo <= p <= hi:
+			yield p
+		for p in self._decode(p, pos):
+			if p > hi:
+				return
+			if p >= lo:
+				yield p
+
+	def segments(self, lo, hi):
+		"""
+		Yields the primes in the interval [lo, hi] in increasing order as a sequence 
+		of arrays, each holding the primes decoded from one chunk of the table.
+		"""
+		if hi > self.limit:
+			raise ValueError("Prime table only goes up to " + str(self.limit))
+		head = array.array('l')
+		if lo <= 2 <= hi:
+			head.append(2)
+		if hi < 3 or self._count == 0:
+			if head:
+				yield head
+			return
+
+		p, pos = self._block(self._find_block(lo))
+		if lo <= p <= hi:
+			head.append(p)
+		if head:
+			yield head
+		for chunk in self._decode_chunks(p, pos):
+			last = chunk[-1]
+			if chunk[0] < lo or last > hi:
+				chunk = array.array('l', [q for q in chunk if lo <= q <= hi])
+			if chunk:
+				yield chunk
+			if last >= hi:
+				return
+
+	def index(self, x):
+		"""
+		Returns the index of the first prime larger than a specified number, i.e. the
+		number of primes which don't exceed it. This coincides with
+		utils.binary_search(x, primes) for the full list of primes.
+
+		Examples:
+			>>> table.index(10)
+			>>> 4
+		"""
+		if x < 2:
+			return 0
+		if x > self.limit:
+			raise ValueError("Prime table only goes up to " + str(self.limit))
+		if x < 3 or self._count == 0:
+			return 1
+
+		b = self._find_block(x)
+		p, pos = self._block(b)
+		if p > x:
+			return 1
+		count = b * self.block_size + 2
+		for p in self._decode(p, pos):
+			if p > x:
+				break
+			count += 1
+		return count
+
+	def __getitem__(self, i):
+		"""
+		Returns the i-th prime (0-indexed) in the table.
+		"""
+		if i < 0:
+			i += len(self)
+		if i < 0 or i >= len(self):
+			raise IndexError("Prime table index out of range")
+		if i == 0:
+			return 2
+
+		b, j = divmod(i - 1, self.block_size)
+		p, pos = self._block(b)
+		if j == 0:
+			return p
+		for p in self._decode(p, pos):
+			j -= 1
+			if j == 0:
+				return p
+
+
+def build_table(path, limit):
+	"""
+	Sieves all the primes up to a specified limit in chunks and writes them to a prime
+	table at a specified path. The table is written to a temporary file first and then
+	moved into place so that concurrent readers never see a partial table.
+	"""
+	block_size = constants.PRIME_TABLE_BLOCK
+	tmp = path + "." + str(os.getpid()) + ".tmp"
+	index, count, last = [], 0, 0
+
+	with open(tmp, "wb") as fp:
+		fp.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0, 0))
+		pos = HEADER.size
+		for segment in primeSieve.prime_segments(3, limit, constants.PRIME_TABLE_CHUNK):
+			buf = bytearray()
+			for p in segment:
+				if count > 0:
+					h = (p - last) >> 1
+					if h < 256:
+						buf.append(h)
+					else:
+						buf.append(0)
+						buf.extend(ESCAPE.pack(h))
+				if count % block_size == 0:
+					index.append((p, pos + len(buf)))
+				last = p
+				count += 1
+			fp.write(buf)
+			pos += len(buf)
+
+		for entry in index:
+			fp.write(INDEX_ENTRY.pack(*entry))
+		fp.seek(0)
+		fp.write(HEADER.pack(MAGIC, VERSION, limit, count, block_size, len(index), pos))
+
+	os.rename(tmp, path)
+
+
+def get_table(limit):
+	"""
+	Returns a prime table containing (at least) all the primes up to a specified limit.
+	The table on disk is reused if it's large enough and rebuilt (with at least double
+	the previous limit to avoid rebuilding repeatedly) otherwise.
+
+	Raises:
+		EnvironmentError if the table can't be read or written
+	"""
+	directory = constants.PRIME_TABLE_DIR
+	path = os.path.join(directory, TABLE_NAME)
+	table = _tables.get(path)
+	if table is not None and table.limit >= limit:
+		return table
+
+	if table is None and os.path.exists(path):
+		table = PrimeTable(path)
+		_tables[path] = table
+		if table.limit >= limit:
+			return table
+
+	new_limit = max(limit, constants.PRIME_TABLE_MIN_LIMIT)
+	if table is not None:
+		new_limit = max(new_limit, 2 * table.limit)
+		table.close()
+		del _tables[path]
+
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	build_table(path, new_limit)
+	table = PrimeTable(path)
+	_tables[path] = table
+	return table
+
+
+def table_for(limit):
+	"""
+	Returns the shared prime table if it's enabled and can hold the primes up to a
+	specified limit, or None otherwise.
+	"""
+	if not constants.USE_PRIME_TABLE:
+		return None
+	try:
+		return get_table(limit)
+	except EnvironmentError:
+		return None
+
+
+def prime_segments(lo, hi):
+	"""
+	Yields the primes in the interval [lo, hi] as a sequence of arrays. The primes come 
+	from the shared prime table if it's enabled (and usable) and are sieved segment by 
+	segment otherwise, so the primes in the interval are never all held in memory at once.
+	"""
+	table = table_for(hi)
+	if table is not None:
+		return table.segments(lo, hi)
+	return primeSieve.prime_segments(lo, hi)
+
+
+def prime_range(lo, hi):
+	"""
+	Returns an iterator over the primes in the interval [lo, hi].
+	"""
+	return itertools.chain.from_iterable(prime_segments(lo, hi))
+
+
+def prime_count(x):
+	"""
+	Returns the number of primes which don't exceed a specified number.
+	"""
+	table = table_for(x)
+	if table is not None:
+		return table.index(x)
+	return sum(len(segment) for segment in primeSieve.prime_segments(2, x))
@@ -0,0 +1,222 @@
+# coding=utf-8
+
+"""
+This module contains product and remainder trees of integers, which do the work of many
+small divisions (or GCDs) with a few large multiplications [1].
+
+-> PRODUCT TREE
+A binary tree whose leaves are the integers and where every other node is the product of
+its children. It's stored as a list of levels with the leaves first and the product of
+all the integers last.
+
+-> REMAINDER TREE
+Reduces an integer modulo every leaf of a product tree at once by reducing it modulo each
+node on the way down, so the numbers being divided shrink as the divisors do.
+
+-> BATCH TRIAL DIVISION
+The product of the small primes is reduced modulo each of a bunch of integers with a
+remainder tree. The GCD of the remainder and the integer is then the product of the small
+primes dividing it, and these are picked out by descending a product tree of the primes
+only along the branches which share a factor with it.
+
+-> BATCH GCD
+Finds the integers in a bunch which share a factor with any of the others. The product P
+of all of them is reduced modulo the square of each one with a remainder tree, and then
+gcd((P mod n^2)/n, n) = gcd(P/n, n) is the part of n it shares with the rest [2]. The 
+shared parts (and what's left of each integer) are then split into pairwise coprime 
+pieces, which every one of those integers is a product of.
+
+Python divides large integers in quadratic time (but multiplies them with Karatsuba), so
+the reductions near the top of the tree are done by multiplying with a reciprocal found
+with Newton's iteration, r -> r + r(2^s - mr)/2^s, which doubles its precision each step.
+
+REFERENCES:
+[1] D.J. Bernstein; How to find smooth parts of integers; Unpublished manuscript (2004)
+    http://cr.yp.to/factorization/smoothparts-20040510.pdf
+[2] N. Heninger, Z. Durumeric, E. Wustrow, J.A. Halderman; Mining your Ps and Qs: 
+    Detection of widespread weak keys in network devices; USENIX Security 2012
+"""
+
+import utils
+
+# Size (in bits) above which remainders are found with a reciprocal instead of a division
+RECIPROCAL_CUTOFF = 20000
+
+
+def product_tree(values):
+	"""
+	Returns the product tree of a list of integers as a list of levels. The first level
+	is the list itself and the last one has the product of all the integers.
+
+	Examples:
+		>>> product_tree([2, 3, 5, 7, 11])
+		>>> [[2, 3, 5, 7, 11], [6, 35, 11], [210, 11], [2310]]
+	"""
+	level = list(values) or [1]
+	tree = [level]
+	while len(level) > 1:
+		level = [level[i] * level[i+1] if i + 1 < len(level) else level[i] \
+					for i in xrange(0, len(level), 2)]
+		tree.append(level)
+	return tree
+
+
+def remainders(x, tree):
+	"""
+	Returns an integer modulo every leaf of a product tree.
+
+	Examples:
+		>>> remainders(100, product_tree([3, 7, 11]))
+		>>> [1, 2, 1]
+	"""
+	rems = [x % tree[-1][0]]
+	for level in reversed(tree[:-1]):
+		rems = [rems[i >> 1] % level[i] for i in xrange(len(level))]
+	return rems
+
+
+def divisors_in_tree(r, tree):
+	"""
+	Returns the leaves of a product tree (of pairwise coprime integers, e.g. primes) which
+	share a factor with a specified integer, in the order they appear in the tree.
+
+	Examples:
+		>>> divisors_in_tree(35, product_tree([2, 3, 5, 7, 11]))
+		>>> [5, 7]
+	"""
+	top = len(tree) - 1
+	g = utils.gcd(r, tree[top][0])
+	if g == 1:
+		return []
+	found, stack = [], [(top, 0, g)]
+	while stack:
+		depth, i, g = stack.pop()
+		if depth == 0:
+			found.append(tree[0][i])
+			continue
+		# Visit the right child first so the leaves come out in order
+		for j in (2*i + 1, 2*i):
+			if j < len(tree[depth - 1]):
+				h = utils.gcd(g, tree[depth - 1][j])
+				if h != 1:
+					stack.append((depth - 1, j, h))
+	return found
+
+
+def trial_divide(numbers, primes_tree):
+	"""
+	Finds the prime factors of each of a bunch of integers among the leaves of a product
+	tree of primes (batch trial division).
+
+	Arguments:
+		numbers (:int list) - the integers to be trial divided
+		primes_tree (:list) - the product tree of the primes to divide by
+
+	Returns:
+		a list with a (factorization, cofactor) tuple for each integer, where the
+		factorization is a list of (prime, exponent) tuples and the cofactor is what's
+		left of the integer after dividing out those primes
+
+	Examples:
+		>>> trial_divide([60, 77, 13], product_tree([2, 3, 5, 7]))
+		>>> [([(2, 2), (3, 1), (5, 1)], 1), ([(7, 1)], 11), ([], 13)]
+	"""
+	if not numbers:
+		return []
+	P = primes_tree[-1][0]
+	results = []
+	for n, z in zip(numbers, remainders(P, product_tree(numbers))):
+		f, r = [], utils.gcd(z, n)
+		if r != 1:
+			for p in divisors_in_tree(r, primes_tree):
+				i = 0
+				while n % p == 0:
+					n //= p
+					i += 1
+				f.append((p, i))
+		results.append((f, n))
+	return results
+
+
+def _reciprocal(m, s):
+	"""
+	Returns 2^s/m rounded down (or a few less) for a positive integer 'm' below 2^s.
+	"""
+	k = m.bit_length()
+	p = s - k
+	if p <= RECIPROCAL_CUTOFF:
+		return (1 << s) // m
+	# Reciprocal of the top bits of m to half the precision (and some guard bits)
+	h = (p >> 1) + 32
+	t = max(k - h, 0)
+	r = _reciprocal(m >> t, s - p + h - t) << (p - h)
+	return r + ((r * ((1 << s) - m*r)) >> s)
+
+
+def _mod(x, m):
+	"""
+	Returns a non-negative integer modulo a positive one, using a reciprocal of the modulus
+	if they're both large.
+	"""
+	if m.bit_length() <= RECIPROCAL_CUTOFF or x.bit_length() - m.bit_length() <= RECIPROCAL_CUTOFF:
+		return x % m
+	s = x.bit_length()
+	r = x - ((x * _reciprocal(m, s)) >> s) * m
+	while r >= m:
+		r -= m
+	return r
+
+
+def batch_gcd(numbers):
+	"""
+	Returns the GCD of each of a list of integers with the product of all the others.
+
+	Examples:
+		>>> batch_gcd([15, 77, 26, 35])
+		>>> [5, 7, 1, 35]
+	"""
+	if len(numbers) < 2:
+		return [1] * len(numbers)
+	tree = product_tree(numbers)
+	rems = [tree[-1][0]]
+	for level in reversed(tree[:-1]):
+		rems = [_mod(rems[i >> 1], level[i] * level[i]) for i in xrange(len(level))]
+	return [utils.gcd(r // n, n) for r, n in zip(rems, numbers)]
+
+
+def coprime_base(values):
+	"""
+	Returns a list of pairwise coprime integers (greater than 1) such that every one of the
+	specified integers is a product of powers of them. The elements of the base sharing a 
+	factor with each integer are found by descending a product tree of the base, which is
+	rebuilt only when the base changes.
+
+	Examples:
+		>>> sorted(coprime_base([6, 10, 15]))
+		>>> [2, 3, 5]
+	"""
+	base, tree = set(), None
+	stack = list(set(x for x in values if x > 1))
+	while stack:
+		x = stack.pop()
+		if x in base:
+			continue
+		if tree is None and base:
+			tree = product_tree(sorted(base))
+		for b in divisors_in_tree(x, tree) if base else []:
+			g = utils.gcd(x, b)
+			while g == b:
+				x //= b
+				g = utils.gcd(x, b)
+			if g != 1:
+				# Replace b by its pieces and refine them (and the rest of x) again
+				base.remove(b)
+				tree = None
+				stack.extend([y for y in (g, b // g, x // g) if y > 1])
+				break
+		else:
+			# What's left of x is coprime to the whole base
+			if x > 1:
+				base.add(x)
+				tree = None
+	return list(base)
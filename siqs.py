@@ -0,0 +1,456 @@
+# coding=utf-8
+
+import math
+import time
+import random
+import utils
+import events
+import primeSieve
+import constants
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+"""
+This module contains an implementation of the self-initializing quadratic sieve (SIQS),
+which finds a factor of 'n' from a congruence of squares X^2 = Y^2 (mod n) assembled
+out of many relations u^2 = Q(u) (mod n) where Q(u) factors over a small set of primes.
+Unlike ECM its running time only depends on the size of 'n', so it's the method of
+choice for composites whose two factors are both large.
+
+-> FACTOR BASE
+The primes p (up to a bound depending on the size of 'n') for which kn is a quadratic
+residue, where the multiplier 'k' is chosen with the Knuth-Schroeppel function so that
+kn has as many small primes in its factor base as possible.
+
+-> POLYNOMIALS
+Each polynomial is Q(x) = (ax + b)^2 - kn = a*g(x) with g(x) = ax^2 + 2bx + c, where 'a'
+is a product of s primes from the factor base close to √(2kn)/M (so |g(x)| is at most
+about M√(kn/2) on the sieve interval [-M, M)) and b^2 = kn (mod a). Every choice of 'a'
+gives 2^(s-1) values of 'b', and going through them in Gray code order lets the roots of
+g(x) modulo each prime be updated with one addition each (self-initialization) [1].
+
+-> SIEVING
+Rather than trial dividing every g(x), log2(p) is added at the positions x where
+p | g(x) (two arithmetic progressions for every prime) and only the x where these add
+up to nearly log2|g(x)| are trial divided. The sieve is vectorized with NumPy if it's
+available. The smallest primes are left out of the sieve since they cost the most and
+contribute the least, which the threshold makes up for.
+
+-> LARGE PRIME VARIATION
+Values of g(x) which factor over the factor base except for one prime below a bound a
+bit larger than the largest prime in the factor base (partial relations) are kept as
+well. Two partial relations with the same large prime multiply to a full relation.
+
+-> LINEAR ALGEBRA
+Once there are more relations than primes in the factor base, the exponent vectors of
+the relations modulo 2 are linearly dependent. Dependencies are found with Gaussian
+elimination over GF(2) (with the vectors packed into integers) and every dependency
+gives a congruence of squares, which splits 'n' with probability at least 1/2.
+
+REFERENCES:
+[1] S.P. Contini; Factoring Integers with the Self-Initializing Quadratic Sieve;
+    Master's thesis, University of Georgia (1997)
+[2] R.D. Silverman; The Multiple Polynomial Quadratic Sieve; Mathematics of
+    Computation, 48-177: 329-339
+"""
+
+# Multipliers considered by the Knuth-Schroeppel function
+MULTIPLIERS = [1, 2, 3, 5, 6, 7, 10, 11, 13, 14, 15, 17, 19, 21, 22, 23, 26, 29, 30, 31, \
+				33, 34, 35, 37, 38, 39, 41, 42, 43, 46, 47, 51, 53, 55, 57, 58, 59, 61, \
+				62, 65, 66, 67, 69, 70, 71, 73]
+
+
+def sqrt_mod(a, p):
+	"""
+	Returns a square root of a quadratic residue modulo an odd prime 'p' with the
+	Tonelli-Shanks algorithm.
+
+	Examples:
+		>>> sqrt_mod(10, 13)
+		>>> 7
+	"""
+	a %= p
+	if a == 0:
+		return 0
+	if p % 4 == 3:
+		return pow(a, (p + 1) >> 2, p)
+	q, s = p - 1, 0
+	while not q & 1:
+		q >>= 1
+		s += 1
+	z = 2
+	while pow(z, (p - 1) >> 1, p) != p - 1:
+		z += 1
+	m, c, t, r = s, pow(z, q, p), pow(a, q, p), pow(a, (q + 1) >> 1, p)
+	while t != 1:
+		i, t2 = 0, t
+		while t2 != 1:
+			t2 = t2 * t2 % p
+			i += 1
+		b = pow(c, 1 << (m - i - 1), p)
+		m, c = i, b * b % p
+		t, r = t * c % p, r * b % p
+	return r
+
+
+def parameters(n):
+	"""
+	Returns the size of the factor base and the half-width M of the sieve interval for
+	a specified composite (from SIQS_PARAMETERS).
+	"""
+	digits = len(str(n))
+	for d, size, M in constants.SIQS_PARAMETERS:
+		if digits <= d:
+			return size, M
+	return constants.SIQS_PARAMETERS[-1][1:]
+
+
+def choose_multiplier(n, primes):
+	"""
+	Returns the multiplier 'k' (among MULTIPLIERS) maximizing the Knuth-Schroeppel
+	function, i.e. the expected contribution of the small primes to the size of the
+	values sieved for kn.
+	"""
+	best, best_k = None, 1
+	for k in MULTIPLIERS:
+		kn = k * n
+		score = -0.5 * math.log(k)
+		if kn % 8 == 1:
+			score += 2 * math.log(2)
+		elif kn % 8 == 5:
+			score += math.log(2)
+		elif kn % 4 == 3:
+			score += 0.5 * math.log(2)
+		for p in primes:
+			if p == 2:
+				continue
+			if k % p == 0:
+				score += math.log(p) / p
+			elif pow(kn % p, (p - 1) >> 1, p) == 1:
+				score += 2 * math.log(p) / (p - 1)
+		if best is None or score > best:
+			best, best_k = score, k
+	return best_k
+
+
+def factor_base(kn, size):
+	"""
+	Returns the first 'size' primes 'p' for which kn is a quadratic residue (or which
+	divide kn) along with the square roots of kn modulo each of them.
+	"""
+	primes, roots = [], []
+	limit = max(100, int(size * math.log(size) * 3))
+	while len(primes) < size:
+		primes, roots = [], []
+		for p in primeSieve.to_list(primeSieve.prime_sieve(limit)):
+			r = kn % p
+			if p == 2:
+				primes.append(2)
+				roots.append(r)
+			elif r == 0 or pow(r, (p - 1) >> 1, p) == 1:
+				primes.append(p)
+				roots.append(sqrt_mod(r, p))
+			if len(primes) == size:
+				break
+		limit <<= 1
+	return primes, roots
+
+
+def _choose_a(kn, M, primes, lo, hi, used, rng):
+	"""
+	Chooses the leading coefficient 'a' of the next batch of polynomials as a product of
+	primes from the factor base (with indices in [lo, hi)) close to √(2kn)/M which wasn't
+	used before. Returns 'a' and the indices of its prime factors.
+	"""
+	target = utils.isqrt(2 * kn) // M
+	log_target = math.log(target)
+	mid = primes[(lo + hi) >> 1]
+	s = max(1, int(round(log_target / math.log(mid))))
+	for _ in xrange(100):
+		chosen, a = set(), 1
+		while len(chosen) < s - 1:
+			i = rng.randrange(lo, hi)
+			if i not in chosen:
+				chosen.add(i)
+				a *= primes[i]
+		# Choose the last prime to get as close as possible to the target
+		ideal = target // a
+		best = None
+		for i in xrange(1, len(primes)):
+			if i in chosen or primes[i] < 3:
+				continue
+			if best is None or abs(primes[i] - ideal) < abs(primes[best] - ideal):
+				best = i
+			if primes[i] > ideal:
+				break
+		chosen.add(best)
+		a *= primes[best]
+		if a not in used:
+			used.add(a)
+			return a, sorted(chosen)
+	return None, None
+
+
+def _dependencies(vectors):
+	"""
+	Finds linear dependencies among exponent vectors modulo 2 (packed into integers) with
+	Gaussian elimination over GF(2). Returns each dependency as an integer with the bits of
+	the vectors in it set.
+
+	Examples:
+		>>> _dependencies([0b011, 0b110, 0b101, 0b100])
+		>>> [7]
+	"""
+	basis, deps = {}, []
+	for i, v in enumerate(vectors):
+		h = 1 << i
+		while v:
+			low = v & -v
+			pivot = basis.get(low)
+			if pivot is None:
+				basis[low] = (v, h)
+				break
+			v ^= pivot[0]
+			h ^= pivot[1]
+		if not v:
+			deps.append(h)
+	return deps
+
+
+def _square_root(n, relations, primes, dep):
+	"""
+	Returns gcd(X - Y, n) for the congruence of squares X^2 = Y^2 (mod n) given by a
+	dependency among the relations.
+	"""
+	Y, counts = 1, {}
+	i = 0
+	while dep:
+		if dep & 1:
+			u, factors = relations[i]
+			Y = Y * u % n
+			for j in factors:
+				counts[j] = counts.get(j, 0) + 1
+		dep >>= 1
+		i += 1
+	X = 1
+	for j, e in counts.iteritems():
+		if j > 0:
+			X = X * pow(primes[j - 1], e >> 1, n) % n
+	return utils.gcd(X - Y, n)
+
+
+def _sieve(size, starts1, starts2, primes, logs):
+	"""
+	Returns the sieve array for one polynomial, with log2(p) added at every position in
+	the arithmetic progressions (one or two per prime) starting at the specified offsets.
+	"""
+	if numpy is not None and constants.USE_NUMPY:
+		sieve = numpy.zeros(size, dtype = numpy.uint8)
+		for p, logp, s1, s2 in zip(primes, logs, starts1, starts2):
+			sieve[s1::p] += logp
+			if s2 != s1:
+				sieve[s2::p] += logp
+		return sieve
+
+	sieve = bytearray(size)
+	for p, logp, s1, s2 in zip(primes, logs, starts1, starts2):
+		for j in xrange(s1, size, p):
+			sieve[j] += logp
+		if s2 != s1:
+			for j in xrange(s2, size, p):
+				sieve[j] += logp
+	return sieve
+
+
+def _candidates(sieve, threshold):
+	"""
+	Returns the positions in a sieve array whose value is at least the threshold.
+	"""
+	if numpy is not None and isinstance(sieve, numpy.ndarray):
+		return numpy.flatnonzero(sieve >= threshold).tolist()
+	return [j for j in xrange(len(sieve)) if sieve[j] >= threshold]
+
+
+def factorize_siqs(n, verbose = False, deadline = None):
+	"""
+	Returns a non-trivial factor of a composite found with the self-initializing quadratic
+	sieve, or -1 if none is found (before the 'deadline', a time as returned by time.time(),
+	if one is specified).
+
+	Examples:
+		>>> factorize_siqs((10**20 + 39) * (10**21 + 117))
+		>>> 100000000000000000039
+	"""
+	if n == 1 or utils.is_prime(n):
+		return n
+	r = utils.isqrt(n)
+	if r * r == n:
+		return r
+
+	t = time.time()
+	events.emit("start", "siqs", n = n)
+	size, M = parameters(n)
+	small = primeSieve.to_list(primeSieve.prime_sieve(constants.SIQS_MULTIPLIER_PRIMES))
+	k = choose_multiplier(n, small)
+	kn = k * n
+	primes, roots = factor_base(kn, size)
+	for p in primes:
+		if n % p == 0 and p < n:
+			events.emit("end", "siqs", n = n, factor = p, elapsed = time.time() - t)
+			return p
+
+	logs = [int(round(math.log(p, 2))) for p in primes]
+	first = 0
+	while first < len(primes) and primes[first] < constants.SIQS_MIN_SIEVE_PRIME:
+		first += 1
+	large_bound = primes[-1] * constants.SIQS_LARGE_PRIME_MULTIPLIER
+	# g(x) is at most about M√(kn/2) on the interval, and a large prime (and the primes
+	# left out of the sieve) may be missing from the sum of logarithms
+	threshold = int(math.log(M * math.sqrt(kn / 2.0), 2) - math.log(large_bound, 2) - \
+					constants.SIQS_THRESHOLD_SLACK)
+	if verbose:
+		print "Multiplier:", k, "Factor base:", len(primes), "primes up to", primes[-1], \
+				"Sieve interval:", 2 * M
+
+	use_numpy = numpy is not None and constants.USE_NUMPY
+
+	rng = random.Random(n)
+	relations, seen, partials, used = [], set(), {}, set()
+	needed = len(primes) + 1 + constants.SIQS_EXTRA_RELATIONS
+	# Primes for 'a' are taken from the middle of the factor base
+	lo, hi = max(first, len(primes) // 3), max(first + 2, 2 * len(primes) // 3)
+	polys, cut = 0, False
+	while len(relations) < needed:
+		a, a_idx = _choose_a(kn, M, primes, lo, hi, used, rng)
+		if a is None:
+			break
+		s = len(a_idx)
+		a_set = set(a_idx)
+
+		# B_l = (a/q_l) * (√kn (a/q_l)^-1 mod q_l) so that b = ±B_1 ± ... ± B_s has b^2 = kn (mod a)
+		B = []
+		for l in a_idx:
+			q = primes[l]
+			aq = a // q
+			gamma = roots[l] * pow(aq % q, q - 2, q) % q
+			if gamma > q >> 1:
+				gamma = q - gamma
+			B.append(aq * gamma)
+		b = sum(B)
+
+		# Roots of g(x) modulo each prime sieved with (the ones not dividing 'a') and their
+		# changes when the sign of one of the B_l is flipped
+		sieved = [i for i in xrange(first, len(primes)) if i not in a_set]
+		vp = [primes[i] for i in sieved]
+		ainv = [pow(a % p, p - 2, p) for p in vp]
+		sol1 = [ai * (roots[i] - b) % p for i, p, ai in zip(sieved, vp, ainv)]
+		sol2 = [ai * (-roots[i] - b) % p for i, p, ai in zip(sieved, vp, ainv)]
+		deltas = [[(2 * Bl % p) * ai % p for p, ai in zip(vp, ainv)] for Bl in B]
+		vlogs = [logs[i] for i in sieved]
+		if use_numpy:
+			sieved, vp = numpy.array(sieved, dtype = numpy.int64), numpy.array(vp, dtype = numpy.int64)
+			sol1, sol2 = numpy.array(sol1, dtype = numpy.int64), numpy.array(sol2, dtype = numpy.int64)
+			deltas = [numpy.array(d, dtype = numpy.int64) for d in deltas]
+		direct = range(first) + a_idx
+
+		for j in xrange(1 << (s - 1)):
+			if j > 0:
+				# Gray code: flip the sign of B_v, the lowest set bit of 2j
+				v = 0
+				while not (j >> v) & 1:
+					v += 1
+				e = 1 if (j >> (v + 1)) & 1 else -1
+				b += 2 * e * B[v]
+				if use_numpy:
+					sol1 = (sol1 - e * deltas[v]) % vp
+					sol2 = (sol2 - e * deltas[v]) % vp
+				else:
+					sol1 = [(x - e * d) % p for x, d, p in zip(sol1, deltas[v], vp)]
+					sol2 = [(x - e * d) % p for x, d, p in zip(sol2, deltas[v], vp)]
+			if utils.expired(deadline):
+				cut = True
+				break
+			polys += 1
+			c = (b * b - kn) // a
+
+			if use_numpy:
+				starts1, starts2 = ((sol1 + M) % vp).tolist(), ((sol2 + M) % vp).tolist()
+				sieve = _sieve(2 * M, starts1, starts2, vp.tolist(), vlogs)
+			else:
+				starts1 = [(x + M) % p for x, p in zip(sol1, vp)]
+				starts2 = [(x + M) % p for x, p in zip(sol2, vp)]
+				sieve = _sieve(2 * M, starts1, starts2, vp, vlogs)
+
+			for pos in _candidates(sieve, threshold):
+				x = pos - M
+				g = (a * x + 2 * b) * x + c
+				u = a * x + b
+				factors = list(i + 1 for i in a_idx)
+				if g < 0:
+					factors.append(0)
+					g = -g
+				# Primes which divide g(x) are the ones with a root congruent to x (and the
+				# ones left out of the sieve or dividing 'a', which are tried directly)
+				if use_numpy:
+					hits = sieved[numpy.flatnonzero(((x - sol1) % vp == 0) | \
+								((x - sol2) % vp == 0))].tolist()
+				else:
+					hits = [i for i, p, r1, r2 in zip(sieved, vp, sol1, sol2) \
+							if (x - r1) % p == 0 or (x - r2) % p == 0]
+				for i in direct + hits:
+					p = primes[i]
+					while g % p == 0:
+						g //= p
+						factors.append(i + 1)
+
+				if g == 1:
+					if u not in seen:
+						seen.add(u)
+						relations.append((u, factors))
+				elif g < large_bound:
+					other = partials.get(g)
+					if other is None:
+						partials[g] = (u, factors)
+					elif other[0] != u:
+						h = utils.gcd(g, n)
+						if h != 1:
+							events.emit("end", "siqs", n = n, factor = h, elapsed = time.time() - t)
+							return h
+						# (u1 u2 / L)^2 = g1 g2 / L^2 (mod n), which factors over the base
+						w = other[0] * u % n * (utils.xgcd(n, g) % n) % n
+						if w not in seen:
+							seen.add(w)
+							relations.append((w, other[1] + factors))
+			if len(relations) >= needed:
+				break
+		if cut:
+			break
+		if verbose:
+			print "Relations:", len(relations), "/", needed, "(" + str(len(partials)), \
+					"partials,", polys, "polynomials)"
+
+	t1 = time.time()
+	events.emit("stage", "siqs", n = n, stage = 1, elapsed = t1 - t, found = None)
+	g = -1
+	if len(relations) >= needed:
+		vectors = []
+		for u, factors in relations:
+			v = 0
+			for j in factors:
+				v ^= 1 << j
+			vectors.append(v)
+		for dep in _dependencies(vectors):
+			h = _square_root(n, relations, primes, dep)
+			if 1 < h < n:
+				g = h
+				break
+		events.emit("stage", "siqs", n = n, stage = 2, elapsed = time.time() - t1, \
+					found = g if g != -1 else None)
+	if verbose:
+		print "SIQS took", time.time() - t, "seconds"
+	events.emit("end", "siqs", n = n, factor = g, elapsed = time.time() - t, \
+				relations = len(relations), polynomials = polys)
+	return g
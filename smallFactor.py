@@ -0,0 +1,263 @@
+# coding=utf-8
+
+import math
+import time
+import utils
+import events
+import primeSieve
+import constants
+
+"""
+This module contains factoring methods for small composites (below SIZE_THRESHOLD_SMALL)
+which beat Pollard rho at that size since they only need arithmetic on
+numbers around the square root of the composite.
+
+-> FERMAT
+Searches for a representation n = a^2 - b^2 = (a - b)(a + b) starting from a = ceil(√n),
+so a factor very close to √n is found in a handful of steps.
+
+-> HART'S ONE LINE FACTORING ALGORITHM
+For i = 1, 2, ... takes s = ceil(√(n*i)) and checks whether s^2 mod n is a square t^2, in
+which case gcd(s - t, n) is (very likely) a factor [1]. Fast in practice, especially with
+a multiplier with many small factors (so n*i is more likely to be a square mod small primes).
+
+-> LEHMAN
+After trial division up to n^(1/3), the same search as Fermat's is done over 4kn for
+k <= n^(1/3) in a short range of a, which is guaranteed to find a factor in O(n^(1/3))
+steps [2]. Used as a fallback on the smallest composites only.
+
+-> SQUFOF
+Shanks' square forms factorization expands √(kn) as a continued fraction until one of
+the denominators is a square, then walks the reverse cycle of the square root of that form
+to a factor [3]. Takes O(n^(1/4)) steps on numbers around √n, which fit in a machine word
+for composites below 2^64.
+
+REFERENCES:
+[1] W.B. Hart; A One Line Factoring Algorithm; Journal of the Australian Mathematical
+    Society, 92-1: 61-69
+[2] R.S. Lehman; Factoring Large Integers; Mathematics of Computation, 28-126: 637-646
+[3] J.E. Gower, S.S. Wagstaff Jr.; Square Form Factorization; Mathematics of Computation,
+    77-261: 551-588
+"""
+
+# Multipliers tried (in order) by SQUFOF, i.e. the square-free products of 3, 5, 7 and 11
+SQUFOF_MULTIPLIERS = [1, 3, 5, 7, 11, 3*5, 3*7, 3*11, 5*7, 5*11, 7*11, 3*5*7, 3*5*11, \
+					3*7*11, 5*7*11, 3*5*7*11]
+
+# Multiplier (with many small factors) for Hart's one line algorithm
+HART_MULTIPLIER = 480
+
+# Quadratic residues modulo 64, 63 and 65, used to rule out most non-squares cheaply
+_squares_64 = set(i*i % 64 for i in xrange(64))
+_squares_63 = set(i*i % 63 for i in xrange(63))
+_squares_65 = set(i*i % 65 for i in xrange(65))
+
+# Primes up to the cube root of SIZE_THRESHOLD_LEHMAN, for Lehman's trial division
+_lehman_primes = primeSieve.to_list(primeSieve.prime_sieve( \
+					int(constants.SIZE_THRESHOLD_LEHMAN ** (1.0/3)) + 2))
+_lehman_product = reduce(lambda x, y: x * y, _lehman_primes, 1)
+
+
+def square_root(n):
+	"""
+	Returns the square root of a non-negative integer if it's a perfect square and -1
+	otherwise.
+
+	Examples:
+		>>> square_root(144)
+		>>> 12
+	"""
+	if (n & 63) not in _squares_64 or n % 63 not in _squares_63 or n % 65 not in _squares_65:
+		return -1
+	r = utils.isqrt(n)
+	return r if r*r == n else -1
+
+
+def ceil_sqrt(n):
+	"""
+	Returns the smallest integer whose square is at least a specified integer.
+	"""
+	r = utils.isqrt(n)
+	return r if r*r == n else r + 1
+
+
+def factorize_fermat(n, max_iterations = constants.FERMAT_ITERATIONS):
+	"""
+	Returns a non-trivial factor of an odd composite found with Fermat's method in at most
+	'max_iterations' steps, or -1 if none is found.
+
+	Examples:
+		>>> factorize_fermat(1000003 * 1000033)
+		>>> 1000003
+	"""
+	a = ceil_sqrt(n)
+	b2 = a*a - n
+	for _ in xrange(max_iterations):
+		b = square_root(b2)
+		if b != -1 and a - b > 1:
+			return a - b
+		# (a + 1)^2 - a^2 = 2a + 1
+		b2 += 2*a + 1
+		a += 1
+	return -1
+
+
+def factorize_hart(n, max_iterations = constants.HART_ITERATIONS, deadline = None):
+	"""
+	Returns a non-trivial factor of a composite found with Hart's one line factoring
+	algorithm in at most 'max_iterations' steps, or -1 if none is found.
+
+	Examples:
+		>>> factorize_hart(1000003 * 1000033)
+		>>> 1000003
+	"""
+	m = HART_MULTIPLIER * n
+	ni = m
+	for i in xrange(1, max_iterations + 1):
+		s = ceil_sqrt(ni)
+		t = square_root(s*s % n)
+		if t != -1:
+			g = utils.gcd(s - t, n)
+			if 1 < g < n:
+				return g
+		ni += m
+		if not i & 1023 and utils.expired(deadline):
+			break
+	return -1
+
+
+def factorize_lehman(n, deadline = None):
+	"""
+	Returns a non-trivial factor of a composite (below SIZE_THRESHOLD_LEHMAN) found with
+	Lehman's method, or -1 if none is found (i.e. if 'n' is prime or the deadline passes).
+
+	Examples:
+		>>> factorize_lehman(10007 * 10009)
+		>>> 10009
+	"""
+	c = int(round(n ** (1.0/3)))
+	while c*c*c > n:
+		c -= 1
+	while (c+1)**3 <= n:
+		c += 1
+	for p in _lehman_primes:
+		if p > c:
+			break
+		if n % p == 0 and p < n:
+			return p
+
+	sixth = n ** (1.0/6)
+	for k in xrange(1, c + 1):
+		fourkn = 4*k*n
+		a = ceil_sqrt(fourkn)
+		# One more than Lehman's bound to allow for rounding
+		a_max = int(math.sqrt(fourkn) + sixth / (4 * math.sqrt(k))) + 1
+		while a <= a_max:
+			b = square_root(a*a - fourkn)
+			if b != -1:
+				g = utils.gcd(a + b, n)
+				if 1 < g < n:
+					return g
+			a += 1
+		if not k & 255 and utils.expired(deadline):
+			break
+	return -1
+
+
+def factorize_squfof(n, deadline = None):
+	"""
+	Returns a non-trivial factor of an odd composite (which isn't a perfect square) found
+	with Shanks' square forms factorization, or -1 if none is found.
+
+	Examples:
+		>>> factorize_squfof(1000003 * 1000033)
+		>>> 1000003
+	"""
+	s = utils.isqrt(n)
+	if s*s == n:
+		return s
+	sqrt = math.sqrt
+	bound = 3 * 2 * int(sqrt(2 * s))
+	for k in SQUFOF_MULTIPLIERS:
+		D = k * n
+		P0 = utils.isqrt(D)
+		Q = D - P0*P0
+		if Q == 0:
+			g = utils.gcd(P0, n)
+			if 1 < g < n:
+				return g
+			continue
+
+		# Forward cycle: expand √D until a denominator at an even position is a square,
+		# two steps at a time so only the even ones are checked
+		P, Q_prev, r = P0, 1, -1
+		for i in xrange(1, bound >> 1):
+			b = (P0 + P) // Q
+			P_next = b*Q - P
+			Q, Q_prev = Q_prev + b*(P - P_next), Q
+			P = P_next
+			# Q is below 2√D, so the square root in floating point is exact
+			r = int(sqrt(Q))
+			if r*r == Q:
+				break
+			b = (P0 + P) // Q
+			P_next = b*Q - P
+			Q, Q_prev = Q_prev + b*(P - P_next), Q
+			P = P_next
+			if not i & 2047 and utils.expired(deadline):
+				return -1
+		else:
+			continue
+
+		# Reverse cycle: start from the square root of the square form and walk until
+		# P repeats (a symmetry point of the cycle)
+		b = (P0 - P) // r
+		P = b*r + P
+		Q_prev, Q = r, (D - P*P) // r
+		for i in xrange(bound):
+			b = (P0 + P) // Q
+			P_next = b*Q - P
+			Q, Q_prev = Q_prev + b*(P - P_next), Q
+			if P_next == P:
+				break
+			P = P_next
+		g = utils.gcd(n, Q_prev)
+		if 1 < g < n:
+			return g
+	return -1
+
+
+def factorize_small(n, verbose = False, deadline = None):
+	"""
+	Returns a non-trivial factor of a composite below SIZE_THRESHOLD_SMALL found with the
+	methods in this module, or -1 if none is found. After a GCD with the product of the
+	primes below 2^14 (in case 'n' wasn't trial divided), a few steps of Fermat's method 
+	and Hart's algorithm are taken (these find factors close to √n or to a small rational
+	multiple of it almost at once), then SQUFOF does the bulk of the work. Lehman's method
+	is the fallback for the smallest composites if SQUFOF runs out of multipliers.
+
+	Examples:
+		>>> factorize_small(999999000001 * 1000003)
+		>>> 1000003
+	"""
+	if n == 1 or utils.is_prime(n):
+		return n
+
+	t = time.time()
+	events.emit("start", "small", n = n)
+	g, method = utils.gcd(n, _lehman_product), "trial"
+	if g != 1:
+		g = next(p for p in _lehman_primes if n % p == 0)
+	else:
+		g, method = factorize_fermat(n), "fermat"
+	if g == -1:
+		g, method = factorize_hart(n, deadline = deadline), "hart"
+	if g == -1:
+		g, method = factorize_squfof(n, deadline), "squfof"
+	if g == -1 and n < constants.SIZE_THRESHOLD_LEHMAN:
+		g, method = factorize_lehman(n, deadline), "lehman"
+	if verbose and g != -1:
+		print "Found factor with", method
+	events.emit("end", "small", n = n, factor = g, elapsed = time.time() - t, \
+				method = method if g != -1 else None)
+	return g
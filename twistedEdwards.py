@@ -0,0 +1,198 @@
+# coding=utf-8
+
+import array
+import utils
+
+"""
+This module contains the arithmetic of twisted Edwards curves ax^2 + y^2 = 1 + dx^2y^2
+modulo n in extended coordinates (X : Y : Z : T), where x = X/Z, y = Y/Z and T = XY/Z
+[1], for the Edwards version of ECM (see ecm.py).
+
+-> CURVES
+Every Montgomery curve By^2 = x^3 + Ax^2 + x is birationally equivalent to the twisted
+Edwards curve with a = (A + 2)/B and d = (A - 2)/B via (x, y) -> (x/y, (x - 1)/(x + 1)).
+The curves used are Suyama's, whose group orders are divisible by 12, with B chosen so
+that Suyama's point has y = 1. The Montgomery x-coordinate of a point is then
+(Z + Y)/(Z - Y), so stage 2 is done on the Montgomery curve.
+
+-> SCALAR MULTIPLICATION
+The scalar is written in width-w non-adjacent form (every non-zero digit is odd, below
+2^(w-1) in absolute value and followed by at least w - 1 zeros) and the odd multiples of
+the point are precomputed and normalized to Z = 1 with a single (batched) inversion, as
+in EECM-MPFQ [2]. A doubling takes 4M + 4S (plus 1M for T when an addition follows) and
+an addition of a precomputed point 8M, since T isn't needed after it. That's roughly
+8 + 9/(w + 1) multiplications per bit against 11 for the Montgomery ladder.
+
+REFERENCES:
+[1] H. Hisil, K.K. Wong, G. Carter, E. Dawson; Twisted Edwards Curves Revisited;
+    Advances in Cryptology - ASIACRYPT 2008: 326-343
+[2] D.J. Bernstein, P. Birkner, T. Lange, C. Peters; ECM using Edwards curves;
+    Mathematics of Computation, 82-282: 1139-1179
+"""
+
+
+def suyama_montgomery(sigma, n):
+	"""
+	Returns the Suyama curve By^2 = x^3 + Ax^2 + x generated by a specified value of sigma
+	as a tuple (A, B, x, a24), where (x, 1) is Suyama's point on it and a24 = (A + 2)/4. 
+	Returns None along with the GCD of 'n' and a number that couldn't be inverted (a factor
+	of 'n' or 'n' itself) if the curve can't be set up.
+	"""
+	u = (sigma * sigma - 5) % n
+	v = (4 * sigma) % n
+	inv, g = utils.batch_inverse([4 * u*u*u * v, v*v*v, 4], n)
+	if inv is None:
+		return None, g
+	vmu = v - u
+	A = (vmu*vmu*vmu * (3*u + v) * inv[0] - 2) % n
+	x = (u*u*u * inv[1]) % n
+	B = (x * (x * (x + A) + 1)) % n
+	return (A, B, x, (A + 2) * inv[2] % n), 1
+
+
+def suyama_curve(sigma, n):
+	"""
+	Returns the twisted Edwards form of the Suyama curve generated by a specified value of
+	sigma as a tuple (a, d, x, y, a24) with a point (x, y) on it and a24 = (A + 2)/4 for
+	the Montgomery form. Returns None along with the GCD of 'n' and a number that couldn't
+	be inverted (a factor of 'n' or 'n' itself) if the curve can't be set up.
+	"""
+	curve, g = suyama_montgomery(sigma, n)
+	if curve is None:
+		return None, g
+	A, B, x0, a24 = curve
+	inv, g = utils.batch_inverse([B, x0 + 1], n)
+	if inv is None:
+		return None, g
+	a = ((A + 2) * inv[0]) % n
+	d = ((A - 2) * inv[0]) % n
+	y = ((x0 - 1) * inv[1]) % n
+	return (a, d, x0, y, a24), 1
+
+
+def naf(k, w):
+	"""
+	Returns the digits of a positive integer in width-w non-adjacent form, most significant
+	first.
+
+	Examples:
+		>>> list(naf(7, 2))
+		>>> [1, 0, 0, -1]
+	"""
+	digits = array.array("b")
+	half, full = 1 << (w - 1), 1 << w
+	while k:
+		if k & 1:
+			r = k & (full - 1)
+			if r >= half:
+				r -= full
+			k -= r
+		else:
+			r = 0
+		digits.append(r)
+		k >>= 1
+	digits.reverse()
+	return digits
+
+
+def table_size(digits):
+	"""
+	Returns the number of odd multiples of the point needed to multiply it by the scalar
+	with the specified non-adjacent form digits.
+	"""
+	return (max(max(digits), -min(digits)) + 1) >> 1
+
+
+def naf_width(bits):
+	"""
+	Returns the width of the non-adjacent form which minimizes the number of additions for
+	a scalar with a specified number of bits, including the ones needed to precompute the
+	odd multiples of the point.
+	"""
+	return min(xrange(2, 9), key = lambda w: (1 << (w - 2)) + bits / (w + 1.0))
+
+
+def point_double(X, Y, Z, n, a, extended = True):
+	"""
+	Doubles a point (in extended coordinates) on the twisted Edwards curve with parameter
+	'a'. T isn't used and is only returned if 'extended' is set (as None otherwise).
+	"""
+	A = X*X % n
+	B = Y*Y % n
+	C = 2*Z*Z % n
+	D = a*A % n
+	E = (X + Y)*(X + Y) - A - B
+	G = D + B
+	F = G - C
+	H = D - B
+	if extended:
+		return E*F % n, G*H % n, F*G % n, E*H % n
+	return E*F % n, G*H % n, F*G % n, None
+
+
+def point_add(X, Y, Z, T, x, y, dt, n, a, extended = False):
+	"""
+	Adds a point (in extended coordinates) and an affine point (x, y) on the twisted
+	Edwards curve with parameters 'a' and 'd', where 'dt' is dxy. T of the sum is only
+	returned if 'extended' is set (as None otherwise).
+	"""
+	A = X*x % n
+	B = Y*y % n
+	C = T*dt % n
+	E = (X + Y)*(x + y) - A - B
+	F = Z - C
+	G = Z + C
+	H = B - a*A
+	if extended:
+		return E*F % n, G*H % n, F*G % n, E*H % n
+	return E*F % n, G*H % n, F*G % n, None
+
+
+def odd_multiples(x, y, count, n, a, d):
+	"""
+	Returns the affine points P, 3P, ..., (2*count - 1)P for a point P = (x, y) as a list
+	of (x, y, dxy) tuples, or None along with the GCD of 'n' and a number that couldn't be
+	inverted.
+	"""
+	points = [(x, y, 1, x*y % n)]
+	if count > 1:
+		X2, Y2, Z2, T2 = point_double(x, y, 1, n, a)
+		inv, g = utils.batch_inverse([Z2], n)
+		if inv is None:
+			return None, g
+		x2, y2 = X2 * inv[0] % n, Y2 * inv[0] % n
+		dt2 = d * x2 % n * y2 % n
+		for _ in xrange(count - 1):
+			X, Y, Z, T = points[-1]
+			points.append(point_add(X, Y, Z, T, x2, y2, dt2, n, a, True))
+
+	inv, g = utils.batch_inverse([Z for _, _, Z, _ in points], n)
+	if inv is None:
+		return None, g
+	table = []
+	for (X, Y, _, _), z in zip(points, inv):
+		px, py = X*z % n, Y*z % n
+		table.append((px, py, d * px % n * py % n))
+	return table, 1
+
+
+def scalar_multiply(digits, table, n, a, deadline = None):
+	"""
+	Multiplies a point by the scalar with the specified non-adjacent form digits, given the
+	odd multiples of the point (see odd_multiples). Returns the product in projective
+	coordinates (X : Y : Z), or (None, None, None) if the deadline passes before it's done.
+	"""
+	x, y, _ = table[digits[0] >> 1]
+	X, Y, Z = x, y, 1
+	for i in xrange(1, len(digits)):
+		r = digits[i]
+		X, Y, Z, T = point_double(X, Y, Z, n, a, r != 0)
+		if r > 0:
+			x, y, dt = table[r >> 1]
+			X, Y, Z, _ = point_add(X, Y, Z, T, x, y, dt, n, a)
+		elif r < 0:
+			x, y, dt = table[-r >> 1]
+			X, Y, Z, _ = point_add(X, Y, Z, T, -x, y, -dt, n, a)
+		if (i & 4095) == 0 and utils.expired(deadline):
+			return None, None, None
+	return X, Y, Z
@@ -1,11 +1,14 @@
 # coding=utf-8
 
 import math
+import time
 import random
 import fractions
+import collections
 
 PRIME_THRESHOLD = 100000
 MR_THRESHOLD = 10**36
+BPSW_THRESHOLD = 341550071728321
 
 def binary_search(x, arr, include_equal = False):
 	"""
@@ -92,6 +95,73 @@ def xgcd(a, b):
 	return r
 
 
+def inverse(a, n):
+	"""
+	Returns the inverse of an integer modulo 'n' (or None if it isn't invertible) along with
+	their GCD, with a single pass of the Extended Euclidean algorithm.
+
+	Examples:
+		>>> inverse(3, 7)
+		>>> (5, 1)
+
+		>>> inverse(6, 15)
+		>>> (None, 3)
+	"""
+	a, b, r, s = n, a % n, 0, 1
+	while b != 0:
+		c, d = divmod(a, b)
+		r, s = s, r - c*s
+		a, b = b, d
+	if a != 1:
+		return None, a
+	return r % n, 1
+
+
+def batch_inverse(values, n):
+	"""
+	Inverts a bunch of integers modulo 'n' at the cost of a single modular inversion and
+	about three multiplications per integer (Montgomery's trick). If the integers aren't 
+	all invertible, the GCD of their product and 'n' is returned instead (which is either
+	a non-trivial factor of 'n' or 'n' itself).
+
+	Arguments:
+		values (:int list) - the integers to be inverted
+		n (:int) - the modulus
+
+	Returns:
+		a tuple with the list of inverses (None if some integer isn't invertible) and the
+		GCD of the product of the integers and 'n'
+
+	Examples:
+		>>> batch_inverse([2, 3], 7)
+		>>> ([4, 5], 1)
+
+		>>> batch_inverse([2, 3], 15)
+		>>> (None, 3)
+	"""
+	prefix, acc = [0] * len(values), 1
+	for i in xrange(len(values)):
+		prefix[i] = acc
+		acc = (acc * values[i]) % n
+	inv, g = inverse(acc, n)
+	if inv is None:
+		return None, g
+
+	inverses = [0] * len(values)
+	for i in xrange(len(values) - 1, -1, -1):
+		inverses[i] = (inv * prefix[i]) % n
+		inv = (inv * values[i]) % n
+	return inverses, 1
+
+
+def expired(deadline):
+	"""
+	Returns True if a deadline (a time as returned by time.time(), or None for no deadline)
+	has passed.
+	"""
+	return deadline is not None and time.time() >= deadline
+
+
 def is_prime_bf(n):
 	"""
 	Tests whether an integer is prime through brute force. A wheel (mod 6)
@@ -159,7 +229,7 @@ def is_prime_fast(n, use_probabilistic = False, tolerance = 30):
 	if n >= MR_THRESHOLD: 
 		logn = math.log(n)
 		if not use_probabilistic: 
-			w = xrange(2, 2 * int(logn*log(logn)/log(2))) 
+			w = xrange(2, 2 * int(logn*math.log(logn)/math.log(2))) 
 		else: 
 			w = xrange(tolerance)
 	elif n >= 1543267864443420616877677640751301: w = firstPrime[:20]
@@ -236,11 +306,154 @@ def is_prime_fast(n, use_probabilistic = False, tolerance = 30):
 	return True
 
 
+def isqrt(n):
+	"""
+	Returns the integer square root of a non-negative integer, i.e. the largest integer
+	whose square doesn't exceed it (with Newton's method, since math.sqrt loses precision
+	on large integers).
+
+	Examples:
+		>>> isqrt(10**40 + 1)
+		>>> 100000000000000000000
+	"""
+	if n < 2:
+		return n
+	x = 1 << ((n.bit_length() + 1) >> 1)
+	while True:
+		y = (x + n // x) >> 1
+		if y >= x:
+			return x
+		x = y
+
+
+def jacobi(a, n):
+	"""
+	Returns the Jacobi symbol (a/n) for an odd positive integer 'n'.
+
+	Examples:
+		>>> jacobi(5, 21)
+		>>> 1
+
+		>>> jacobi(7, 15)
+		>>> -1
+	"""
+	a, result = a % n, 1
+	while a:
+		while not a & 1:
+			a >>= 1
+			if n & 7 == 3 or n & 7 == 5:
+				result = -result
+		a, n = n, a
+		if a & 3 == 3 and n & 3 == 3:
+			result = -result
+		a %= n
+	return result if n == 1 else 0
+
+
+def is_strong_prp(n, a):
+	"""
+	Tests whether an odd integer is a strong probable prime to a specified base (a single
+	round of the Miller-Rabin test).
+	"""
+	d, s = n - 1, 0
+	while not d & 1:
+		d >>= 1
+		s += 1
+	x = pow(a, d, n)
+	if x == 1 or x == n - 1:
+		return True
+	for _ in xrange(s - 1):
+		x = x*x % n
+		if x == n - 1:
+			return True
+	return False
+
+
+def is_strong_lucas_prp(n):
+	"""
+	Tests whether an odd integer (which isn't a perfect square) is a strong Lucas probable
+	prime with Selfridge's parameters, i.e. P = 1 and Q = (1 - D)/4 where D is the first
+	of 5, -7, 9, -11, ... with (D/n) = -1.
+
+	Reference:
+	R. Baillie, S.S. Wagstaff; Lucas Pseudoprimes; Mathematics of Computation, 35-152: 
+	1391-1417
+	"""
+	D = 5
+	while True:
+		j = jacobi(D, n)
+		if j == -1:
+			break
+		if j == 0 and abs(D) != n:
+			return False
+		D = -D - 2 if D > 0 else -D + 2
+	P, Q = 1, (1 - D) // 4
+
+	# n + 1 = d * 2^s with d odd
+	d, s = n + 1, 0
+	while not d & 1:
+		d >>= 1
+		s += 1
+
+	# Compute U_d, V_d and Q^d (mod n) from the top bit of d down
+	U, V, Qk = 1, P, Q % n
+	for bit in bin(d)[3:]:
+		U, V = (U * V) % n, (V * V - 2 * Qk) % n
+		Qk = (Qk * Qk) % n
+		if bit == '1':
+			U, V = P*U + V, D*U + P*V
+			if U & 1:
+				U += n
+			if V & 1:
+				V += n
+			U, V = (U >> 1) % n, (V >> 1) % n
+			Qk = (Qk * Q) % n
+
+	if U == 0 or V == 0:
+		return True
+	for _ in xrange(s - 1):
+		V = (V * V - 2 * Qk) % n
+		if V == 0:
+			return True
+		Qk = (Qk * Qk) % n
+	return False
+
+
+def is_prime_bpsw(n):
+	"""
+	Tests whether a number is (probably) prime with the Baillie-PSW test, i.e. a strong
+	probable prime test to base 2 followed by a strong Lucas probable prime test. This 
+	costs about as much as three Miller-Rabin rounds. No composite passing it is known 
+	and there are none below 2^64.
+
+	Examples:
+		>>> is_prime_bpsw(2**127 - 1)
+		>>> True
+
+		>>> is_prime_bpsw(3825123056546413051)
+		>>> False
+	"""
+	if n < 2:
+		return False
+	for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47):
+		if n % p == 0:
+			return n == p
+	if not is_strong_prp(n, 2):
+		return False
+	r = isqrt(n)
+	if r * r == n:
+		return False
+	return is_strong_lucas_prp(n)
+
+
 def is_prime(n, use_probabilistic = False, tolerance = 30):
 	"""
 	Tests whether a number is prime. The choice of test used depeneds on the size of 
-	the specified number. Optionally tests whether the specified number is probably 
-	prime up to a given tolerance using the regular version of the Miller-Rabin test. 
+	the specified number: trial division for small numbers, a deterministic Miller-Rabin
+	test below BPSW_THRESHOLD and the Baillie-PSW test above it (which is deterministic
+	below 2^64 and costs a few modular exponentiations however large the number is).
+	Optionally tests whether the specified number is probably prime up to a given 
+	tolerance using the regular version of the Miller-Rabin test. 
 
 	Arguments:
 		n (:int) - the integer to be tested
@@ -267,8 +480,74 @@ def is_prime(n, use_probabilistic = False, tolerance = 30):
 		if use_probabilistic:
 			return is_prime_fast(n, use_probabilistic, tolerance)
 		else:
-			if n < MR_THRESHOLD:
+			if n < BPSW_THRESHOLD:
 				return is_prime_fast(n)
 			else:
-				return is_prime_fast(n, True, 40)
+				return is_prime_bpsw(n)
+
+
+class LRUCache(object):
+	"""
+	A least-recently-used cache whose total size is capped. The size of each value is 
+	measured by a specified function (every value counts as 1 by default) and the least 
+	recently used values are evicted once the total size exceeds the cap. Values which are
+	larger than the cap on their own are never cached.
+
+	Examples:
+		>>> cache = LRUCache(2)
+		>>> cache.put(1, 'a'); cache.put(2, 'b'); cache.get(1); cache.put(3, 'c')
+		>>> cache.get(2)
+		>>> None
+	"""
+	def __init__(self, max_size, sizeof = None):
+		self.max_size = max_size
+		self.size = 0
+		self._sizeof = sizeof if sizeof is not None else (lambda value: 1)
+		self._entries = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def get(self, key, default = None):
+		"""
+		Returns the value cached for a specified key (marking it as the most recently
+		used) or a default value if there is none.
+		"""
+		if key not in self._entries:
+			return default
+		value, size = self._entries.pop(key)
+		self._entries[key] = (value, size)
+		return value
+
+	def put(self, key, value):
+		"""
+		Caches a value for a specified key and evicts the least recently used values if
+		the cache grew too large. Returns True if the value was cached.
+		"""
+		if key in self._entries:
+			self.size -= self._entries.pop(key)[1]
+		size = self._sizeof(value)
+		if size > self.max_size:
+			return False
+		self._entries[key] = (value, size)
+		self.size += size
+		while self.size > self.max_size:
+			self.size -= self._entries.popitem(last = False)[1][1]
+		return True
+
+	def keys(self):
+		"""
+		Returns the cached keys from the least to the most recently used.
+		"""
+		return list(self._entries)
+
+	def clear(self):
+		"""
+		Empties the cache.
+		"""
+		self._entries.clear()
+		self.size = 0
 
@@ -0,0 +1,221 @@
+# coding=utf-8
+
+import utils
+import twistedEdwards
+
+"""
+This module contains the arithmetic of many curves y^2 = x^3 + ax + b modulo n at once in
+affine coordinates, for the batched version of ECM (see ecm.py).
+
+-> CURVES
+The Montgomery curve By^2 = x^3 + Ax^2 + x is isomorphic to the short Weierstrass curve
+with a = (3 - A^2)/(3B^2) via (x, y) -> (x/B + A/(3B), y/B), so Suyama's curves (see
+twistedEdwards.py) are used in this form. A point (x, y) maps back to the Montgomery
+x-coordinate (3Bx - A : 3), so stage 2 is done on the Montgomery curves.
+
+-> SIMULTANEOUS INVERSION
+An affine doubling or addition needs one modular inversion (of 2y or of x2 - x1), which
+costs a hundred or more multiplications. Since the curves go through the same doublings
+and additions in lockstep, the inversions of a step are done together with Montgomery's
+trick [1] for one inversion and three multiplications per curve. A doubling then takes
+about 7 multiplications and an addition 6, against 11 per bit for the Montgomery ladder.
+If a denominator can't be inverted, the point is the point at infinity modulo some
+prime factor of n (or modulo all of them, in which case the curve is dropped).
+
+REFERENCES:
+[1] P.L. Montgomery; Speeding the Pollard and Elliptic Curve Methods of Factorization;
+    Mathematics of Computation, 48-177: 243-264
+"""
+
+
+def from_montgomery(A, B, x, n):
+	"""
+	Returns the short Weierstrass form of the Montgomery curve By^2 = x^3 + Ax^2 + x as a
+	tuple (a, x, y) where (x, y) is the image of its point (x, 1). Returns None along with
+	the GCD of 'n' and a number that couldn't be inverted if 3B isn't invertible.
+	"""
+	inv, g = utils.batch_inverse([3 * B], n)
+	if inv is None:
+		return None, g
+	i = inv[0]
+	return (3 * (3 - A*A) * i % n * i % n, (3*x + A) * i % n, 3 * i % n), 1
+
+
+def invert(values, n):
+	"""
+	Inverts a bunch of integers modulo 'n' with a single modular inversion.
+
+	Returns:
+		a tuple with the list of inverses (None for the integers which are 0 modulo 'n')
+		and a non-trivial factor of 'n' if one turned up (in which case the inverses are
+		None) or 1
+	"""
+	inverses, g = utils.batch_inverse(values, n)
+	if inverses is not None:
+		return inverses, 1
+	if g != n:
+		return None, g
+	# Some of the integers are 0 modulo n (or share different factors with it)
+	for v in values:
+		g = utils.gcd(v, n)
+		if g != 1 and g != n:
+			return None, g
+	live = [v for v in values if v % n]
+	inverses, g = utils.batch_inverse(live, n)
+	if inverses is None:
+		return None, g
+	it = iter(inverses)
+	return [next(it) if v % n else None for v in values], 1
+
+
+def scalar_multiply(digits, curves, n, deadline = None):
+	"""
+	Multiplies a point on each of a bunch of curves by the scalar with the specified
+	non-adjacent form digits (see twistedEdwards.naf), all in lockstep.
+
+	Arguments:
+		digits (:array) - the non-adjacent form of the scalar, most significant digit first
+		curves (:list) - the (a, x, y) tuples of the curves and the points on them
+		n (:int) - the modulus
+		deadline (:float) - the time (as returned by time.time()) to give up after
+
+	Returns:
+		a tuple with the list of products (as affine (x, y) tuples, or None for curves
+		which were dropped) and a non-trivial factor of 'n' if one turned up (in which case
+		the products are None), 1 if not or -1 if the deadline passed
+	"""
+	live = range(len(curves))
+	coeffs = [a for a, _, _ in curves]
+	xs = [x for _, x, _ in curves]
+	ys = [y for _, _, y in curves]
+
+	def double(xs, ys):
+		m = len(xs)
+		prefix, acc = [0] * m, 1
+		for i in xrange(m):
+			prefix[i] = acc
+			acc = acc * (2 * ys[i]) % n
+		inv, g = utils.inverse(acc, n)
+		if inv is None:
+			return slow_double(xs, ys)
+		rx, ry = [0] * m, [0] * m
+		for i in xrange(m - 1, -1, -1):
+			x, y = xs[i], ys[i]
+			# 1/(2y) from the inverse of the product of the denominators so far
+			l = inv * prefix[i] % n * (3*x*x + coeffs[i]) % n
+			inv = inv * (2*y) % n
+			x3 = (l*l - 2*x) % n
+			rx[i], ry[i] = x3, (l * (x - x3) - y) % n
+		return rx, ry, 1, []
+
+	def add(xs, ys, px, py):
+		m = len(xs)
+		prefix, acc = [0] * m, 1
+		for i in xrange(m):
+			prefix[i] = acc
+			acc = acc * (px[i] - xs[i]) % n
+		inv, g = utils.inverse(acc, n)
+		if inv is None:
+			return slow_add(xs, ys, px, py)
+		rx, ry = [0] * m, [0] * m
+		for i in xrange(m - 1, -1, -1):
+			x, x2 = xs[i], px[i]
+			l = inv * prefix[i] % n * (py[i] - ys[i]) % n
+			inv = inv * (x2 - x) % n
+			x3 = (l*l - x - x2) % n
+			rx[i], ry[i] = x3, (l * (x - x3) - ys[i]) % n
+		return rx, ry, 1, []
+
+	# The same with a separate inversion step which deals with denominators which aren't
+	# invertible (only used once one turns up)
+	def slow_double(xs, ys):
+		inv, g = invert([2*y for y in ys], n)
+		if g != 1:
+			return None, None, g, None
+		rx, ry, dead = [], [], []
+		for i in xrange(len(xs)):
+			if inv[i] is None:
+				dead.append(i)
+				continue
+			x, y = xs[i], ys[i]
+			l = (3*x*x + coeffs[i]) * inv[i] % n
+			x3 = (l*l - 2*x) % n
+			rx.append(x3)
+			ry.append((l * (x - x3) - y) % n)
+		return rx, ry, 1, dead
+
+	def slow_add(xs, ys, px, py):
+		inv, g = invert([x2 - x1 for x1, x2 in zip(xs, px)], n)
+		if g != 1:
+			return None, None, g, None
+		rx, ry, dead = [], [], []
+		for i in xrange(len(xs)):
+			if inv[i] is None:
+				dead.append(i)
+				continue
+			x = xs[i]
+			l = (py[i] - ys[i]) * inv[i] % n
+			x3 = (l*l - x - px[i]) % n
+			rx.append(x3)
+			ry.append((l * (x - x3) - ys[i]) % n)
+		return rx, ry, 1, dead
+
+	def drop(dead, lists):
+		# Curves whose point is at infinity modulo every prime factor of n are useless
+		dead = set(dead)
+		return [[v for i, v in enumerate(l) if i not in dead] for l in lists]
+
+	# Odd multiples P, 3P, 5P, ... of the points, as lists of coordinates over the curves
+	count = twistedEdwards.table_size(digits)
+	table_x, table_y = [xs], [ys]
+	if count > 1:
+		dx, dy, g, dead = double(xs, ys)
+		if g != 1:
+			return None, g
+		if dead:
+			live, coeffs, xs, ys = drop(dead, [live, coeffs, xs, ys])
+			table_x, table_y = [xs], [ys]
+		while len(table_x) < count:
+			x3, y3, g, dead = add(table_x[-1], table_y[-1], dx, dy)
+			if g != 1:
+				return None, g
+			if dead:
+				# The point has small order modulo n, which multiples of it share
+				lists = drop(dead, [live, coeffs, dx, dy] + table_x + table_y)
+				live, coeffs, dx, dy = lists[:4]
+				m = len(table_x)
+				table_x, table_y = lists[4:4 + m], lists[4 + m:]
+			table_x.append(x3)
+			table_y.append(y3)
+
+	xs, ys = table_x[digits[0] >> 1], table_y[digits[0] >> 1]
+	for j in xrange(1, len(digits)):
+		xs, ys, g, dead = double(xs, ys)
+		if g != 1:
+			return None, g
+		if dead:
+			lists = drop(dead, [live, coeffs] + table_x + table_y)
+			live, coeffs = lists[:2]
+			m = len(table_x)
+			table_x, table_y = lists[2:2 + m], lists[2 + m:]
+		r = digits[j]
+		if r:
+			px = table_x[abs(r) >> 1]
+			py = table_y[abs(r) >> 1] if r > 0 else [-y for y in table_y[-r >> 1]]
+			xs, ys, g, dead = add(xs, ys, px, py)
+			if g != 1:
+				return None, g
+			if dead:
+				lists = drop(dead, [live, coeffs] + table_x + table_y)
+				live, coeffs = lists[:2]
+				m = len(table_x)
+				table_x, table_y = lists[2:2 + m], lists[2 + m:]
+		if not live:
+			break
+		if (j & 1023) == 0 and utils.expired(deadline):
+			return None, -1
+
+	products = [None] * len(curves)
+	for i, x, y in zip(live, xs, ys):
+		products[i] = (x, y)
+	return products, 1